@@ -1,96 +1,1057 @@
+import base64
+import json
+import math
+import threading
+import time
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from collections import defaultdict
-from models import Story, User, UserInteraction, db
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
+from sklearn.preprocessing import normalize
+from sqlalchemy import func, or_
+from collections import namedtuple
+from models import Story, User, UserInteraction, UserPreference, db
+from database import read_session
+import materialized
+import model_store
+from cache import RecommendationCache
+from catalog import StoryColumns, StoryRecord
+from instrumentation import stage
 from datetime import datetime, timedelta
 from flask import current_app
 
 
+# Category preference weights in [0.25, 1]. UserPreference.weight is the
+# source of truth; the 'high'/'medium'/'low' labels are only used at the
+# API edge. Feedback doubles or halves a weight, so it must stay above 0.
+PREFERENCE_WEIGHTS = {'high': 1.0, 'medium': 0.5, 'low': 0.25}
+MIN_PREFERENCE_WEIGHT = PREFERENCE_WEIGHTS['low']
+MAX_PREFERENCE_WEIGHT = PREFERENCE_WEIGHTS['high']
+DEFAULT_PREFERENCE_WEIGHT = PREFERENCE_WEIGHTS['medium']
+
+# Largest number of ids bound into one IN (...) clause
+QUERY_CHUNK_SIZE = 500
+
+# Upper bound on the cells of a users x stories score matrix held at once
+SCORE_BLOCK_ELEMENTS = 5_000_000
+
+
+def preference_weight(value):
+    """Convert a preference label or number to a weight"""
+    if isinstance(value, str):
+        return PREFERENCE_WEIGHTS.get(value.lower())
+    if isinstance(value, (int, float)) and not isinstance(value, bool) \
+            and math.isfinite(value):
+        return clamp_weight(float(value))
+    return None
+
+
+def clamp_weight(weight):
+    """Limit a weight to the range feedback can move it in"""
+    return min(max(weight, MIN_PREFERENCE_WEIGHT), MAX_PREFERENCE_WEIGHT)
+
+
+def preference_level(weight):
+    """Convert a weight to the nearest preference label"""
+    if weight >= 0.75:
+        return 'high'
+    elif weight >= 0.375:
+        return 'medium'
+    else:
+        return 'low'
+
+
+def load_preference_rows(user_ids):
+    """Load (user_id, category, weight) rows for many users"""
+    rows = []
+    for start in range(0, len(user_ids), QUERY_CHUNK_SIZE):
+        rows += read_session.query(
+            UserPreference.user_id, UserPreference.category,
+            UserPreference.weight
+        ).filter(UserPreference.user_id.in_(
+            user_ids[start:start + QUERY_CHUNK_SIZE])).all()
+    return rows
+
+
+def load_preference_weights(user_id):
+    """Load a user's category weights as a dict"""
+    return dict(read_session.query(
+        UserPreference.category, UserPreference.weight
+    ).filter(UserPreference.user_id == user_id).all())
+
+
+def save_preference_weights(user_id, weights):
+    """Insert or update a user's category weights. The caller commits."""
+    existing = {p.category: p for p in
+                UserPreference.query.filter_by(user_id=user_id).all()}
+    for category, weight in weights.items():
+        preference = existing.get(category)
+        if preference is None:
+            db.session.add(UserPreference(
+                user_id=user_id, category=category, weight=weight))
+        else:
+            preference.weight = weight
+            preference.last_updated = datetime.utcnow()
+
+
+def load_story_popularity():
+    """Load (story_id, positive interaction count) rows for every liked story"""
+    return read_session.query(
+        UserInteraction.story_id, func.count()
+    ).filter(UserInteraction.is_positive.is_(True)).group_by(
+        UserInteraction.story_id).all()
+
+
+def top_per_group(codes, rank, n_groups, limit):
+    """The ``limit`` best-ranked rows of each group.
+
+    Returns the rows ordered by group, then by rank, and the bounds of
+    each group's rows, like the category index of a snapshot.
+    """
+    order = np.lexsort((rank, codes))
+    bounds = np.searchsorted(codes[order], np.arange(n_groups + 1))
+    within = np.arange(len(order)) - bounds[codes[order]]
+    rows = order[within < limit]
+    return rows, np.searchsorted(codes[rows], np.arange(n_groups + 1))
+
+
+def touch_users(user_ids, when=None):
+    """Bump the interaction version of ``user_ids``. The caller commits."""
+    User.query.filter(User.id.in_(user_ids)).update({
+        User.interaction_version: User.interaction_version + 1,
+        User.interactions_updated_at: when or datetime.utcnow()
+    }, synchronize_session=False)
+
+
+def encode_cursor(state):
+    """Encode pagination state as an opaque, URL-safe cursor"""
+    data = json.dumps(state, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decode a cursor made by encode_cursor, raising ValueError if it is invalid"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        state = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(state, dict) or not isinstance(state.get('o'), int) \
+            or state['o'] < 0:
+        raise ValueError('Invalid cursor')
+    return state
+
+
+# An immutable, self-consistent view of the model. Snapshots are never
+# modified after they are built; a refresh builds a new one and publishes
+# it by replacing StoryRecommender.snapshot.
+ModelSnapshot = namedtuple('ModelSnapshot', [
+    'version',
+    'story_ids',
+    'story_index',
+    'columns',
+    'category_index',
+    'vectorizer',
+    'term_counts',
+    'document_frequency',
+    'idf',
+    'story_vectors',
+    'similarity_index',
+    'drift_tokens',
+    'total_tokens',
+    'last_update',
+])
+
+
+# Per-user scoring inputs, one row per user: category preference weights
+# (users x categories) and sparse users x stories / users x authors
+# interaction matrices over a snapshot's rows
+UserSignals = namedtuple('UserSignals', [
+    'preferences',
+    'recent_positive',
+    'author_ratio',
+    'liked',
+])
+
+
+def take_users(signals, start, stop):
+    """The signals of users ``start`` to ``stop - 1``"""
+    return UserSignals(*(matrix[start:stop] for matrix in signals))
+
+
+def score_rows(signals, rows, category_codes, author_codes, similarity_index):
+    """Score users against the stories at ``rows`` from their signals.
+
+    Pure array work with no database access, so it can run in any process
+    that holds the model's arrays. Returns a users x rows matrix in [0, 1].
+    """
+    # Category preference (40% weight)
+    scores = 0.4 * signals.preferences[:, category_codes[rows]]
+
+    # Recent interactions (30% weight)
+    scores += 0.3 * signals.recent_positive[:, rows].toarray()
+
+    # Author preference (20% weight)
+    scores += 0.2 * signals.author_ratio[:, author_codes[rows]].toarray()
+
+    # Content similarity (10% weight)
+    # Mean similarity to each user's liked stories, gathered from the
+    # precomputed top-k neighbour rows of those stories
+    liked = signals.liked
+    liked_counts = np.asarray(liked.sum(axis=1)).ravel()
+    has_liked = liked_counts > 0
+    similarity_sums = (liked @ similarity_index)[:, rows].toarray()
+    scores[has_liked] += 0.1 * (
+        similarity_sums[has_liked] / liked_counts[has_liked, None])
+
+    return np.minimum(scores, 1.0)  # Ensure scores are between 0 and 1
+
+
+# Story rows used to generate a user's candidates without touching the
+# whole catalog: the most popular rows overall and of each category,
+# grouped like ModelSnapshot.category_index, and the first rows of each
+# (author, category) pair in catalog order. author_groups holds the
+# sorted author_code * n_categories + category_code key of each pair.
+# Built per snapshot, see StoryRecommender._candidate_index.
+CandidateIndex = namedtuple('CandidateIndex', [
+    'version',
+    'built_at',
+    'popular',
+    'category_rows',
+    'category_bounds',
+    'author_rows',
+    'author_groups',
+    'author_bounds',
+])
+
+
 class StoryRecommender:
-    def __init__(self):
-        self.vectorizer = TfidfVectorizer(stop_words='english')
-        self.story_vectors = None
-        self.story_ids = None
-        self.user_preferences = {}
-        self.last_update = None
-        self.update_model()
-
-    def update_model(self):
-        """Update the model with all stories from the database"""
+    def __init__(self, similarity_top_k=50, vocabulary_drift_threshold=0.1,
+                 artifact_dir=None, cache_size=1024, cache_ttl=300,
+                 candidate_pool_size=500, exact_scoring_limit=5000,
+                 candidate_refresh_interval=300):
+        self.similarity_top_k = similarity_top_k
+        self.vocabulary_drift_threshold = vocabulary_drift_threshold
+        self.artifact_dir = artifact_dir
+        # Categories with more than exact_scoring_limit stories are ranked
+        # from about candidate_pool_size generated candidates per request
+        self.candidate_pool_size = candidate_pool_size
+        self.exact_scoring_limit = exact_scoring_limit
+        # Popularity moves with feedback even when the stories do not, so
+        # the refresh worker rebuilds the candidate index every
+        # candidate_refresh_interval seconds
+        self.candidate_refresh_interval = candidate_refresh_interval
+        self.snapshot = None
+        # Candidate indexes of the newest snapshots, keyed by version
+        self.candidate_indexes = {}
+        self._candidate_lock = threading.Lock()
+        # Full ranked lists keyed by (user_id, category, model version)
+        self.cache = RecommendationCache(cache_size, cache_ttl)
+        self.refresh_worker = None
+        self._build_lock = threading.Lock()
+        if self.artifact_dir:
+            self.load_artifacts()
+        self.update_model(incremental=True)
+
+    @property
+    def story_vectors(self):
+        return self.snapshot.story_vectors if self.snapshot else None
+
+    @property
+    def story_ids(self):
+        return self.snapshot.story_ids if self.snapshot else None
+
+    @property
+    def version(self):
+        return self.snapshot.version if self.snapshot else None
+
+    @property
+    def last_update(self):
+        return self.snapshot.last_update if self.snapshot else None
+
+    def update_model(self, incremental=False, if_missing=False):
+        """Build a new model snapshot from the database and publish it.
+
+        With ``incremental=True`` only stories created or changed since the
+        last update are vectorized against the existing vocabulary. A full
+        refit happens instead when there is no model yet, when stories were
+        removed, or when the share of out-of-vocabulary tokens seen since
+        the last full fit exceeds ``vocabulary_drift_threshold``.
+
+        With ``if_missing=True`` nothing is built when a model is already
+        published, including one published while waiting for the lock.
+        """
         if not current_app:
             return
 
-        stories = Story.query.all()
+        with self._build_lock:
+            previous = self.snapshot
+            # Concurrent cold-start requests queue on the lock; only the
+            # first one builds
+            if if_missing and previous is not None and previous.story_vectors is not None:
+                return
+            snapshot = None
+            if incremental and previous is not None and previous.term_counts is not None:
+                snapshot = self._build_incremental_snapshot(previous)
+            if snapshot is None:
+                snapshot = self._build_full_snapshot(previous)
+
+            # Built before the snapshot is published, so request threads
+            # never build it themselves
+            if len(snapshot.story_ids) > self.exact_scoring_limit:
+                self._candidate_index(snapshot)
+
+            # Publishing is a single reference swap, so readers always see
+            # either the old or the new snapshot in full
+            self.snapshot = snapshot
+
+            changed = previous is None or snapshot.version != previous.version
+            if self.artifact_dir and changed and snapshot.vectorizer is not None:
+                model_store.save_snapshot(snapshot, self.artifact_dir)
+
+    def load_artifacts(self):
+        """Publish the model persisted in artifact_dir, if there is one.
+
+        Arrays are memory-mapped rather than read, so every worker on a
+        host shares one page-cache copy and startup does not scale with
+        the catalog size. Returns True when a model was loaded.
+        """
+        try:
+            snapshot = model_store.load_snapshot(
+                self.artifact_dir, self._make_snapshot)
+        except Exception as e:
+            print(f"Error loading model artifacts: {str(e)}")
+            return False
+
+        if snapshot is None:
+            return False
+        with self._build_lock:
+            self.snapshot = snapshot
+        return True
+
+    def start_refresh_worker(self, app, interval, on_refresh=None):
+        """Start rebuilding the model in a background thread every ``interval`` seconds.
+
+        The same thread rebuilds the candidate index every
+        ``candidate_refresh_interval`` seconds.
+
+        ``on_refresh`` is called inside the app context after each rebuild,
+        for state that should be refreshed on the same schedule.
+        """
+        if self.refresh_worker is None:
+            self.refresh_worker = ModelRefreshWorker(
+                app, self, interval, on_refresh)
+            self.refresh_worker.start()
+        return self.refresh_worker
+
+    def request_refresh(self):
+        """Ask for an incremental model refresh, in the background when possible"""
+        if self.refresh_worker is not None:
+            self.refresh_worker.wake()
+        else:
+            self.update_model(incremental=True)
+
+    def _build_full_snapshot(self, previous):
+        """Fit a new vocabulary and model over every story"""
+        started = datetime.utcnow()
+        version = previous.version + 1 if previous else 1
+        stories = self._story_query().order_by(Story.id).all()
         if not stories:
-            self.story_vectors = None
-            self.story_ids = []
-            return
+            return ModelSnapshot(
+                version=version, story_ids=[], story_index={},
+                columns=None, category_index={}, vectorizer=None,
+                term_counts=None, document_frequency=None, idf=None,
+                story_vectors=None, similarity_index=None, drift_tokens=0,
+                total_tokens=0, last_update=None)
 
-        # Prepare story data for vectorization
-        story_data = []
-        self.story_ids = []
-        for story in stories:
-            story_data.append(f"{story.title} {story.description}")
-            self.story_ids.append(story.id)
+        # Term counting and IDF weighting are kept separate so that the
+        # document frequencies can be updated in place as stories change
+        vectorizer = CountVectorizer(stop_words='english')
+        transformer = TfidfTransformer()
 
         # Vectorize stories
-        self.story_vectors = self.vectorizer.fit_transform(story_data)
-        self.last_update = datetime.now()
+        term_counts = vectorizer.fit_transform(
+            [self._story_text(story) for story in stories])
+        document_frequency = np.bincount(
+            term_counts.indices, minlength=term_counts.shape[1])
+        story_vectors = transformer.fit_transform(term_counts)
+
+        return self._make_snapshot(
+            version=version,
+            columns=StoryColumns.from_values(
+                [story.id for story in stories],
+                [story.category for story in stories],
+                [story.author for story in stories],
+                [story.created_at for story in stories]),
+            vectorizer=vectorizer,
+            term_counts=term_counts,
+            document_frequency=document_frequency,
+            idf=transformer.idf_,
+            story_vectors=story_vectors,
+            drift_tokens=0,
+            total_tokens=0,
+            last_update=started)
+
+    def _build_incremental_snapshot(self, previous):
+        """Apply new and changed stories on top of the previous snapshot.
+
+        Returns None when a full refit is needed instead.
+        """
+        started = datetime.utcnow()
+        # Sorted here rather than in SQL: ORDER BY id would make SQLite
+        # scan the table instead of using the two timestamp indexes
+        changed = sorted(self._story_query().filter(or_(
+            Story.created_at >= previous.last_update,
+            Story.updated_at >= previous.last_update
+        )), key=lambda story: story.id)
+        new_stories = [s for s in changed if s.id not in previous.story_index]
+        updated_stories = [s for s in changed if s.id in previous.story_index]
+
+        # Deleted stories cannot be detected from timestamps
+        expected = len(previous.story_ids) + len(new_stories)
+        if read_session.query(Story).count() != expected:
+            return None
+        if not changed:
+            return previous._replace(last_update=started)
+
+        # Rows of counts follow updated_stories, then new_stories
+        counts, drift_tokens, total_tokens = self._count_terms(
+            previous.vectorizer,
+            [self._story_text(s) for s in updated_stories + new_stories])
+        drift_tokens += previous.drift_tokens
+        total_tokens += previous.total_tokens
+        if total_tokens and \
+                drift_tokens / total_tokens > self.vocabulary_drift_threshold:
+            return None
+
+        n_stories = len(previous.story_ids)
+        term_counts = previous.term_counts
+        document_frequency = previous.document_frequency.copy()
+        rows = np.array([previous.story_index[s.id] for s in updated_stories],
+                        dtype=np.int64)
+        if updated_stories:
+            document_frequency -= np.bincount(
+                term_counts[rows].indices, minlength=len(document_frequency))
+
+            # Swap the changed rows for their new term counts
+            keep = np.ones(n_stories, dtype=np.int64)
+            keep[rows] = 0
+            scatter = sparse.csr_matrix(
+                (np.ones(len(rows), dtype=np.int64),
+                 (rows, np.arange(len(rows)))),
+                shape=(n_stories, len(rows)))
+            term_counts = term_counts.multiply(keep[:, None]) + \
+                scatter @ counts[:len(updated_stories)]
+
+        document_frequency += np.bincount(
+            counts.indices, minlength=len(document_frequency))
+        if new_stories:
+            term_counts = sparse.vstack(
+                [term_counts, counts[len(updated_stories):]])
+
+        term_counts = sparse.csr_matrix(term_counts)
+        term_counts.eliminate_zeros()
+
+        # Smoothed IDF and L2-normalised rows, as TfidfTransformer computes them
+        n_documents = term_counts.shape[0]
+        idf = np.log((1 + n_documents) / (1 + document_frequency)) + 1
+        story_vectors = normalize(sparse.csr_matrix(term_counts.multiply(idf)))
+
+        # Only the neighbours of changed and new stories are recomputed
+        changed_rows = np.concatenate(
+            [rows, np.arange(n_stories, n_documents, dtype=np.int64)])
+        similarity_index = self._update_similarity_index(
+            previous.similarity_index, story_vectors, changed_rows,
+            self.similarity_top_k)
+
+        return self._make_snapshot(
+            version=previous.version + 1,
+            columns=previous.columns.with_changes(
+                rows, updated_stories, new_stories),
+            similarity_index=similarity_index,
+            vectorizer=previous.vectorizer,
+            term_counts=term_counts,
+            document_frequency=document_frequency,
+            idf=idf,
+            story_vectors=story_vectors,
+            drift_tokens=drift_tokens,
+            total_tokens=total_tokens,
+            last_update=started)
+
+    def _make_snapshot(self, columns, story_vectors, similarity_index=None,
+                       **fields):
+        """Derive the id, category and similarity indexes and build a snapshot"""
+        if similarity_index is None:
+            similarity_index = self._build_similarity_index(
+                story_vectors, self.similarity_top_k)
+
+        # Rows of each category, in row order
+        order = np.argsort(columns.category_codes, kind='stable')
+        bounds = np.searchsorted(columns.category_codes[order],
+                                 np.arange(len(columns.categories) + 1))
+
+        story_ids = columns.ids.tolist()
+        return ModelSnapshot(
+            story_ids=story_ids,
+            story_index={sid: row for row, sid in enumerate(story_ids)},
+            columns=columns,
+            category_index={category: order[bounds[code]:bounds[code + 1]]
+                            for code, category in enumerate(columns.categories)},
+            story_vectors=story_vectors,
+            similarity_index=similarity_index,
+            **fields)
+
+    @staticmethod
+    def _count_terms(vectorizer, documents):
+        """Count in-vocabulary terms, also returning out-of-vocabulary and total token counts"""
+        analyzer = vectorizer.build_analyzer()
+        vocabulary = vectorizer.vocabulary_
+
+        indptr, indices = [0], []
+        drift_tokens = total_tokens = 0
+        for document in documents:
+            for token in analyzer(document):
+                total_tokens += 1
+                column = vocabulary.get(token)
+                if column is None:
+                    drift_tokens += 1
+                else:
+                    indices.append(column)
+            indptr.append(len(indices))
+
+        counts = sparse.csr_matrix(
+            (np.ones(len(indices), dtype=np.int64), indices, indptr),
+            shape=(len(documents), len(vocabulary)))
+        counts.sum_duplicates()
+        return counts, drift_tokens, total_tokens
+
+    @staticmethod
+    def _story_query():
+        """Query the story fields the model needs, leaving out the content text"""
+        return read_session.query(
+            Story.id, Story.title, Story.description, Story.author,
+            Story.category, Story.created_at)
+
+    @staticmethod
+    def _story_text(story):
+        """Text used to vectorize a story"""
+        return f"{story.title} {story.description}"
+
+    @staticmethod
+    def _build_similarity_index(vectors, top_k, block_elements=10_000_000):
+        """Build a sparse story x story matrix holding each row's top-k cosine neighbours.
+
+        TF-IDF rows are L2-normalised, so a dot product is the cosine
+        similarity. Rows are processed in blocks to bound the size of the
+        dense similarity slice held in memory at once.
+        """
+        n_stories = vectors.shape[0]
+        k = min(top_k, n_stories)
+        block_size = max(1, block_elements // n_stories)
+        vectors_t = vectors.T.tocsc()
+
+        rows, cols, values = [], [], []
+        for start in range(0, n_stories, block_size):
+            block = (vectors[start:start + block_size] @ vectors_t).toarray()
+            block_rows, block_cols, block_values = StoryRecommender._top_k(block, k)
+            rows.append(block_rows + start)
+            cols.append(block_cols)
+            values.append(block_values)
+
+        return sparse.csr_matrix(
+            (np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))),
+            shape=(n_stories, n_stories))
+
+    @staticmethod
+    def _update_similarity_index(index, vectors, changed_rows, top_k,
+                                 block_elements=10_000_000):
+        """Update a similarity index for the stories at ``changed_rows``.
+
+        ``index`` is the previous snapshot's index; changed rows past its
+        end are new stories. Changed rows, and rows that had a changed
+        story among their neighbours, get their top-k neighbours computed
+        afresh. Every other row keeps its neighbours, merged with its
+        current similarities to the changed rows, so new stories also show
+        up as neighbours of old ones. The cost grows with the number of
+        changed stories rather than with the square of the catalog.
+        Similarities between two unchanged stories keep the IDF weights of
+        the build that computed them until the next full refit.
+        """
+        n_stories = vectors.shape[0]
+        k = min(top_k, n_stories)
+        old = index.tocoo()
+        old_rows = old.row.astype(np.int64)
+        old_cols = old.col.astype(np.int64)
+
+        is_changed = np.zeros(n_stories, dtype=bool)
+        is_changed[changed_rows] = True
+        # A row that loses a neighbour cannot tell which story was ranked
+        # next, so it is recomputed too
+        recompute = is_changed.copy()
+        recompute[old_rows[is_changed[old_cols]]] = True
+        recompute_rows = np.flatnonzero(recompute)
+
+        block_size = max(1, block_elements // n_stories)
+        vectors_t = vectors.T.tocsc()
+        fresh, pairs = [], []
+        for start in range(0, len(recompute_rows), block_size):
+            block_rows = recompute_rows[start:start + block_size]
+            block = (vectors[block_rows] @ vectors_t).toarray()
+            rows, cols, values = StoryRecommender._top_k(block, k)
+            fresh.append((block_rows[rows], cols, values))
+
+            # The other rows' similarities to the changed rows
+            rows, cols = np.nonzero((block > 0) & is_changed[block_rows, None] & ~recompute)
+            pairs.append((cols, block_rows[rows], block[rows, cols]))
+
+        pair_rows, pair_cols, pair_values = (
+            np.concatenate(part) for part in zip(*pairs))
+        fresh_rows, fresh_cols, fresh_values = (
+            np.concatenate(part) for part in zip(*fresh))
+
+        # Rows gaining a changed neighbour rank their neighbours again
+        affected = np.zeros(n_stories, dtype=bool)
+        affected[pair_rows] = True
+        kept = ~recompute[old_rows]
+        again = kept & affected[old_rows]
+        rows = np.concatenate([old_rows[again], pair_rows])
+        cols = np.concatenate([old_cols[again], pair_cols])
+        values = np.concatenate([old.data[again], pair_values])
+        order = np.lexsort((-values, rows))
+        first = np.searchsorted(rows[order], rows[order])
+        order = order[np.arange(len(order)) - first < k]
+
+        unchanged = kept & ~affected[old_rows]
+        return sparse.csr_matrix(
+            (np.concatenate([old.data[unchanged], values[order], fresh_values]),
+             (np.concatenate([old_rows[unchanged], rows[order], fresh_rows]),
+              np.concatenate([old_cols[unchanged], cols[order], fresh_cols]))),
+            shape=(n_stories, n_stories))
+
+    @staticmethod
+    def _top_k(block, k):
+        """Positions, columns and values of each block row's top-k positive similarities"""
+        n_stories = block.shape[1]
+        if k < n_stories:
+            neighbours = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        else:
+            neighbours = np.tile(np.arange(n_stories), (block.shape[0], 1))
+        values = np.take_along_axis(block, neighbours, axis=1)
+        keep = values > 0
+        return np.nonzero(keep)[0], neighbours[keep], values[keep]
 
     def get_recommendations(self, user_id, category='All', recommendation_type='highly_recommended'):
         """Get story recommendations for a user"""
         if not current_app:
             return []
 
-        # Update model if needed
-        if self.story_vectors is None or not self.story_ids:
-            self.update_model()
-            if self.story_vectors is None or not self.story_ids:
-                return []
+        # Return different number of recommendations based on type
+        if recommendation_type == 'highly_recommended':
+            # Top 6 highly recommended
+            return self.get_ranked_recommendations(user_id, category, 0, 6)
+        elif recommendation_type == 'because_you_listened':
+            # Next 6 recommendations
+            return self.get_ranked_recommendations(user_id, category, 6, 6)
+        else:  # new_discoveries
+            # Next 6 recommendations
+            return self.get_ranked_recommendations(user_id, category, 12, 6)
 
-        # Get user preferences and recent interactions
-        user = User.query.get(user_id)
-        if not user:
+    def get_ranked_recommendations(self, user_id, category='All', offset=0, limit=None):
+        """Get a user's candidate stories, best match first.
+
+        The full ranking is cached per user, category and model version, so
+        the page sections and repeat page loads share one computation. Only
+        the requested slice is loaded from the database for display.
+        """
+        if not current_app:
             return []
 
-        # Get all stories
-        stories = Story.query.all()
-        if not stories:
+        ranking = self._rank(user_id, category)
+        if ranking is None:
+            return []
+
+        story_ids, scores = ranking
+        end = len(scores) if limit is None else offset + limit
+        with stage('sort'):
+            selected = self._ranked_slice(scores, offset, end)
+        story_ids, scores = story_ids[selected], scores[selected]
+
+        match_scores = dict(zip(story_ids.tolist(), scores.tolist()))
+        with stage('records'):
+            records = StoryRecord.load(story_ids)
+        return [self._format_recommendation(record, match_scores[record.id])
+                for record in records]
+
+    def get_top_scores(self, user_id, category='All', limit=6):
+        """Get a user's ``limit`` best ``(story_id, score)`` pairs, best first"""
+        if not current_app:
+            return []
+
+        ranking = self._rank(user_id, category)
+        if ranking is None:
+            return []
+
+        story_ids, scores = ranking
+        with stage('sort'):
+            selected = self._ranked_slice(scores, 0, limit)
+        return list(zip(story_ids[selected].tolist(), scores[selected].tolist()))
+
+    def get_recommendations_batch(self, user_ids, category='All', limit=6):
+        """Get the top ``limit`` recommendations for many users at once.
+
+        Returns a dict mapping each known user id to its recommendations;
+        unknown ids are left out. See ``rank_batch`` for how users are scored.
+        """
+        return self.format_ranked(self.rank_batch(user_ids, category, limit))
+
+    def format_ranked(self, ranked):
+        """Serialize ``{user_id: [(story_id, score), ...]}`` rankings for display"""
+        # Display fields for every story returned, in one pass
+        needed = {sid for pairs in ranked.values() for sid, _ in pairs}
+        with stage('records'):
+            records = {record.id: record for record in StoryRecord.load(sorted(needed))}
+        return {
+            user_id: [self._format_recommendation(records[sid], score)
+                      for sid, score in pairs if sid in records]
+            for user_id, pairs in ranked.items()
+        }
+
+    def rank_batch(self, user_ids, category='All', limit=6):
+        """Get the top ``limit`` ``(story_id, score)`` pairs for many users at once.
+
+        Users are scored in blocks as one users x stories matrix, so the
+        catalog is read once and the interaction and preference data for a
+        block is loaded with a handful of queries. Unknown user ids are
+        left out of the result.
+        """
+        if not current_app:
+            return {}
+
+        snapshot = self._current_snapshot()
+        if snapshot is None:
+            return {}
+
+        with stage('db'):
+            user_ids = self.known_user_ids(user_ids)
+        rows = self._candidate_rows(snapshot, category)
+        candidate_ids = snapshot.columns.ids[rows]
+        block_size = max(1, SCORE_BLOCK_ELEMENTS // max(len(rows), 1))
+
+        ranked = {}
+        for start in range(0, len(user_ids), block_size):
+            block = user_ids[start:start + block_size]
+            scores = self._score_matrix(block, rows, snapshot)
+            with stage('sort'):
+                for user_id, user_scores in zip(block, scores):
+                    selected = self._ranked_slice(user_scores, 0, limit)
+                    ranked[user_id] = list(zip(candidate_ids[selected].tolist(),
+                                               user_scores[selected].tolist()))
+        return ranked
+
+    @staticmethod
+    def known_user_ids(user_ids):
+        """Distinct ``user_ids`` that exist, in their original order"""
+        user_ids = list(dict.fromkeys(int(uid) for uid in user_ids))
+        known = set()
+        for start in range(0, len(user_ids), QUERY_CHUNK_SIZE):
+            known.update(uid for (uid,) in read_session.query(User.id).filter(
+                User.id.in_(user_ids[start:start + QUERY_CHUNK_SIZE])))
+        return [uid for uid in user_ids if uid in known]
+
+    def categories(self):
+        """Categories present in the current model"""
+        snapshot = self._current_snapshot()
+        if snapshot is None:
             return []
+        return list(snapshot.columns.categories)
 
+    def _format_recommendation(self, record, score):
+        """Serialize a story record and its match score"""
+        return {
+            'id': record.id,
+            'title': record.title,
+            'author': record.author,
+            'category': record.category,
+            'description': record.description,
+            'match_score': self._get_preference_level(score),
+            'cover_image': 'https://picsum.photos/300/400'  # Use consistent placeholder image
+        }
+
+    def get_recommendations_page(self, user_id, category='All', cursor=None, page_size=6):
+        """Get one page of a user's recommendations and the cursor for the next page.
+
+        Later pages reuse the cached score vector, so scrolling does not
+        re-score the catalog. Returns ``(recommendations, next_cursor)``;
+        ``next_cursor`` is None on the last page. Raises ValueError for a
+        cursor that is malformed or was issued for another user or category.
+        """
+        if not current_app:
+            return [], None
+
+        offset = 0
+        if cursor:
+            state = decode_cursor(cursor)
+            if state.get('u') != str(user_id) or state.get('c') != category:
+                raise ValueError('Cursor does not match this request')
+            offset = state['o']
+
+        ranking = self._rank(user_id, category)
+        if ranking is None:
+            return [], None
+
+        recommendations = self.get_ranked_recommendations(
+            user_id, category, offset, page_size)
+        next_offset = offset + page_size
+        next_cursor = None
+        if next_offset < len(ranking[1]):
+            next_cursor = encode_cursor(
+                {'u': str(user_id), 'c': category, 'o': next_offset})
+        return recommendations, next_cursor
+
+    def _current_snapshot(self):
+        """Return the published snapshot, building one if there is none yet"""
+        # Update model if needed
+        snapshot = self.snapshot
+        if snapshot is None or snapshot.story_vectors is None:
+            self.update_model(if_missing=True)
+            snapshot = self.snapshot
+            if snapshot is None or snapshot.story_vectors is None:
+                return None
+        return snapshot
+
+    @staticmethod
+    def _candidate_rows(snapshot, category):
+        """Snapshot rows of the stories eligible for a category"""
         # Filter by category if specified
         if category != 'All':
-            stories = [s for s in stories if s.category == category]
-
-        # Calculate match scores for each story
-        recommendations = []
-        for story in stories:
-            match_score = self._calculate_match_score(user, story)
-
-            # Format the recommendation
-            recommendation = {
-                'id': story.id,
-                'title': story.title,
-                'author': story.author,
-                'category': story.category,
-                'description': story.description,
-                'match_score': self._get_preference_level(match_score),
-                'cover_image': 'https://picsum.photos/300/400'  # Use consistent placeholder image
-            }
-            recommendations.append(recommendation)
-
-        # Sort by match score
-        recommendations.sort(key=lambda x: self._get_score_value(
-            x['match_score']), reverse=True)
+            return snapshot.category_index.get(
+                category, np.array([], dtype=np.int64))
+        return np.arange(len(snapshot.story_ids))
 
-        # Return different number of recommendations based on type
-        if recommendation_type == 'highly_recommended':
-            return recommendations[:6]  # Top 6 highly recommended
-        elif recommendation_type == 'because_you_listened':
-            return recommendations[6:12]  # Next 6 recommendations
-        else:  # new_discoveries
-            return recommendations[12:18]  # Next 6 recommendations
+    def _rank(self, user_id, category):
+        """Score a user's candidate stories, returning unsorted (story_ids, scores) arrays"""
+        snapshot = self._current_snapshot()
+        if snapshot is None:
+            return None
+
+        # Ids arrive as ints or strings depending on the route
+        cache_key = (str(user_id), category, snapshot.version)
+        ranking = self.cache.get(cache_key)
+        if ranking is not None:
+            return ranking
+
+        # Get user preferences and recent interactions
+        with stage('db'):
+            user = read_session.get(User, user_id)
+        if not user:
+            return None
+
+        rows = self._candidate_rows(snapshot, category)
+        if len(rows) > self.exact_scoring_limit:
+            # Large catalogs: fully score only a few hundred likely stories
+            with stage('db'):
+                signals = self._user_signals([user.id], snapshot)
+            with stage('candidates'):
+                rows = self._generate_candidates(signals, snapshot, category)
+            with stage('score'):
+                scores = score_rows(signals, rows, snapshot.columns.category_codes,
+                                    snapshot.columns.author_codes,
+                                    snapshot.similarity_index)[0]
+        else:
+            # Score every candidate story in a single batched pass
+            scores = self._score_matrix([user.id], rows, snapshot)[0]
+
+        ranking = (snapshot.columns.ids[rows], scores)
+        self.cache.set(cache_key, ranking)
+        return ranking
+
+    def refresh_candidate_index(self):
+        """Rebuild the published snapshot's candidate index from current popularity.
+
+        Requests keep using the previous index until the new one is
+        swapped in.
+        """
+        snapshot = self.snapshot
+        if snapshot is None or len(snapshot.story_ids) <= self.exact_scoring_limit:
+            return
+        index = self._build_candidate_index(snapshot)
+        with self._candidate_lock:
+            self._store_candidate_index(index)
+
+    def _candidate_index(self, snapshot):
+        """The candidate index of ``snapshot``, building it if there is none yet"""
+        index = self.candidate_indexes.get(snapshot.version)
+        if index is not None:
+            return index
+        with self._candidate_lock:
+            index = self.candidate_indexes.get(snapshot.version)
+            if index is None:
+                index = self._build_candidate_index(snapshot)
+                self._store_candidate_index(index)
+            return index
+
+    def _store_candidate_index(self, index):
+        """Swap in ``index``, keeping those of the two newest snapshots.
+
+        Requests still scoring against the previous snapshot keep finding
+        its index. The caller holds the candidate lock.
+        """
+        indexes = {**self.candidate_indexes, index.version: index}
+        self.candidate_indexes = {version: indexes[version]
+                                  for version in sorted(indexes)[-2:]}
+
+    def _build_candidate_index(self, snapshot):
+        """Index the snapshot's stories for candidate generation.
+
+        Popularity is the number of positive interactions; stories without
+        any, and ties, are ordered newest first so fresh stories still
+        surface. Stories of one author and category all score the same
+        for a user unless liked or similar to a liked story, so those
+        groups keep catalog order, the order exact scoring breaks ties in.
+        """
+        columns = snapshot.columns
+        built_at = datetime.utcnow()
+        likes = np.zeros(len(columns))
+        for story_id, count in load_story_popularity():
+            row = snapshot.story_index.get(story_id)
+            if row is not None:
+                likes[row] = count
+
+        n_stories = len(columns)
+        order = np.lexsort((np.arange(n_stories),
+                            -columns.created_at.astype(np.int64), -likes))
+        rank = np.empty(n_stories, dtype=np.int64)
+        rank[order] = np.arange(n_stories)
+
+        category_rows, category_bounds = top_per_group(
+            columns.category_codes, rank, len(columns.categories),
+            self.candidate_pool_size)
+        keys = columns.author_codes.astype(np.int64) * len(columns.categories) \
+            + columns.category_codes
+        author_order = np.argsort(keys, kind='stable')
+        author_groups, starts = np.unique(keys[author_order], return_index=True)
+        within = np.arange(n_stories) - np.repeat(
+            starts, np.diff(np.append(starts, n_stories)))
+        kept = within < self.candidate_pool_size
+        author_rows = author_order[kept]
+        author_bounds = np.searchsorted(
+            keys[author_rows], np.append(author_groups, np.iinfo(np.int64).max))
+        return CandidateIndex(
+            version=snapshot.version,
+            built_at=built_at,
+            popular=order[:self.candidate_pool_size],
+            category_rows=category_rows,
+            category_bounds=category_bounds,
+            author_rows=author_rows,
+            author_groups=author_groups,
+            author_bounds=author_bounds)
+
+    def _generate_candidates(self, signals, snapshot, category):
+        """Pick a user's candidate rows for full scoring, in catalog order.
+
+        Merges the popular stories of the user's preferred categories (of
+        ``category`` alone when one is given), the user's liked stories and
+        their nearest neighbours, the stories of authors the user liked,
+        and the overall popularity list. Authors' stories are taken from
+        their (author, category) groups with the highest combined author
+        and category score first, which is how exact scoring orders them.
+        The work depends on the user's history and the pool size, not on
+        the catalog size. ``signals`` holds the one user's rows.
+        """
+        index = self._candidate_index(snapshot)
+        columns = snapshot.columns
+        limit = self.candidate_pool_size
+
+        def category_top(code, count):
+            start = index.category_bounds[code]
+            return index.category_rows[start:min(start + count, index.category_bounds[code + 1])]
+
+        parts = []
+        if category == 'All':
+            code = None
+            parts.append(index.popular)
+            weights = signals.preferences[0]
+            total = weights.sum()
+            for preferred in np.flatnonzero(weights > 0):
+                # The pool is shared out by preference weight
+                parts.append(category_top(
+                    preferred, int(np.ceil(limit * weights[preferred] / total))))
+        else:
+            code = columns.categories.index(category)
+            parts.append(category_top(code, limit))
+
+        # Liked stories and the stories most similar to them
+        liked = signals.liked.indices
+        parts.append(liked)
+        neighbours = snapshot.similarity_index[liked]
+        if neighbours.nnz:
+            rows, inverse = np.unique(neighbours.indices, return_inverse=True)
+            similarity = np.bincount(inverse, weights=neighbours.data)
+            if len(rows) > limit:
+                rows = rows[np.argpartition(-similarity, limit - 1)[:limit]]
+            parts.append(rows)
+
+        # Stories by the authors the user liked, best scoring groups first
+        # until the pool is filled
+        n_categories = len(columns.categories)
+        ratios = signals.author_ratio.getrow(0)
+        liked_authors = ratios.data > 0
+        authors = ratios.indices[liked_authors].astype(np.int64)
+        first = np.searchsorted(index.author_groups, authors * n_categories)
+        last = np.searchsorted(index.author_groups, (authors + 1) * n_categories)
+        groups = np.concatenate([np.arange(start, stop, dtype=np.int64)
+                                 for start, stop in zip(first, last)] or
+                                [np.array([], dtype=np.int64)])
+        categories = index.author_groups[groups] % n_categories
+        group_scores = 0.4 * signals.preferences[0][categories] + \
+            0.2 * np.repeat(ratios.data[liked_authors], last - first)
+        if code is not None:
+            groups = groups[categories == code]
+            group_scores = group_scores[categories == code]
+        groups = groups[np.argsort(-group_scores, kind='stable')]
+        sizes = index.author_bounds[groups + 1] - index.author_bounds[groups]
+        for group in groups[:np.searchsorted(np.cumsum(sizes), limit) + 1]:
+            parts.append(index.author_rows[
+                index.author_bounds[group]:index.author_bounds[group + 1]])
+
+        rows = np.unique(np.concatenate(parts).astype(np.int64))
+        if code is not None:
+            rows = rows[columns.category_codes[rows] == code]
+        return rows
+
+    @staticmethod
+    def _ranked_slice(scores, start, stop):
+        """Positions of the scores ranked ``start`` to ``stop - 1``, best first.
+
+        Ranks order scores from highest to lowest, with ties kept in
+        catalog order, so consecutive slices never overlap or skip stories.
+        Selection is linear in the number of scores; only the slice itself
+        is sorted.
+        """
+        stop = min(stop, len(scores))
+        if start >= stop:
+            return np.array([], dtype=np.int64)
+
+        # Scores at the first and last rank of the slice
+        bounds = -np.partition(-scores, sorted({start, stop - 1}))
+        high, low = bounds[start], bounds[stop - 1]
+
+        # Tied scores at either edge are split between slices by position
+        above_high = np.count_nonzero(scores > high)
+        if high == low:
+            tied = np.flatnonzero(scores == high)
+            return tied[start - above_high:stop - above_high]
+
+        above_low = np.count_nonzero(scores > low)
+        selected = np.concatenate([
+            np.flatnonzero(scores == high)[start - above_high:],
+            np.flatnonzero((scores < high) & (scores > low)),
+            np.flatnonzero(scores == low)[:stop - above_low],
+        ])
+        return selected[np.lexsort((selected, -scores[selected]))]
+
+    def invalidate_user(self, user_id):
+        """Forget cached recommendations after a user's state changes"""
+        self.cache.invalidate_user(str(user_id))
 
     def _get_preference_level(self, score):
         """Convert numerical score to preference level"""
@@ -101,122 +1062,256 @@ class StoryRecommender:
         else:
             return 'low'
 
-    def _get_score_value(self, level):
-        """Convert preference level to numerical value for sorting"""
-        return {'high': 3, 'medium': 2, 'low': 1}.get(level, 0)
-
-    def _calculate_match_score(self, user, story):
-        """Calculate match score between user and story"""
-        if not current_app:
-            return 0.0
-
-        score = 0.0
-
-        # Category preference (40% weight)
-        if story.category in user.preferences:
-            preference = user.preferences[story.category]
-            if preference == 'high':
-                score += 0.4
-            elif preference == 'medium':
-                score += 0.2
-            elif preference == 'low':
-                score += 0.1
-
-        # Recent interactions (30% weight)
-        recent_interactions = UserInteraction.query.filter(
-            UserInteraction.user_id == user.id,
-            UserInteraction.story_id == story.id,
-            UserInteraction.created_at >= datetime.utcnow() - timedelta(days=30)
-        ).all()
-
-        if recent_interactions:
-            positive_interactions = sum(
-                1 for i in recent_interactions if i.is_positive)
-            score += 0.3 * (positive_interactions / len(recent_interactions))
-
-        # Author preference (20% weight)
-        author_stories = Story.query.filter_by(author=story.author).all()
-        if author_stories:
-            author_interactions = UserInteraction.query.filter(
-                UserInteraction.user_id == user.id,
-                UserInteraction.story_id.in_([s.id for s in author_stories])
-            ).all()
-            if author_interactions:
-                positive_author = sum(
-                    1 for i in author_interactions if i.is_positive)
-                score += 0.2 * (positive_author / len(author_interactions))
-
-        # Content similarity (10% weight)
-        if self.story_vectors is not None and story.id in self.story_ids:
-            story_idx = self.story_ids.index(story.id)
-            story_vector = self.story_vectors[story_idx]
-
-            # Get user's liked stories
-            liked_stories = UserInteraction.query.filter_by(
-                user_id=user.id,
-                is_positive=True
+    def _load_interactions(self, user_ids):
+        """Load the interactions of many users along with the story author"""
+        interactions = []
+        for start in range(0, len(user_ids), QUERY_CHUNK_SIZE):
+            interactions += read_session.query(
+                UserInteraction.user_id,
+                UserInteraction.story_id,
+                UserInteraction.is_positive,
+                UserInteraction.created_at,
+                Story.author
+            ).join(Story, Story.id == UserInteraction.story_id).filter(
+                UserInteraction.user_id.in_(
+                    user_ids[start:start + QUERY_CHUNK_SIZE])
             ).all()
+        return interactions
+
+    def _score_matrix(self, user_ids, rows, snapshot):
+        """Calculate match scores between users and the stories at ``rows`` of a snapshot.
+
+        Returns a users x stories matrix. Each signal is a matrix operation:
+        category preferences gathered through the stories' category codes,
+        and sparse users x stories / users x authors interaction matrices.
+        Interactions and preferences are loaded with one query per chunk
+        of users, never per story.
+        """
+        if not len(user_ids) or not len(rows):
+            return np.zeros((len(user_ids), len(rows)))
+
+        columns = snapshot.columns
+        with stage('db'):
+            signals = self._user_signals(user_ids, snapshot)
+        with stage('score'):
+            return score_rows(signals, rows, columns.category_codes,
+                              columns.author_codes, snapshot.similarity_index)
 
-            if liked_stories:
-                liked_story_ids = [i.story_id for i in liked_stories]
-                liked_indices = [self.story_ids.index(
-                    sid) for sid in liked_story_ids if sid in self.story_ids]
-                if liked_indices:
-                    liked_vectors = self.story_vectors[liked_indices]
-                    similarities = cosine_similarity(
-                        story_vector, liked_vectors)
-                    score += 0.1 * np.mean(similarities)
+    def _user_signals(self, user_ids, snapshot):
+        """Load the users' preferences and interactions as matrices over the snapshot"""
+        columns = snapshot.columns
+        story_index = snapshot.story_index
+        n_users = len(user_ids)
+        n_stories = len(columns)
+        positions = {user_id: position for position,
+                     user_id in enumerate(user_ids)}
 
-        return min(score, 1.0)  # Ensure score is between 0 and 1
+        category_codes = {category: code for code,
+                          category in enumerate(columns.categories)}
+        preferences = np.zeros((n_users, len(columns.categories)))
+        for user_id, category, weight in load_preference_rows(user_ids):
+            code = category_codes.get(category)
+            if code is not None:
+                preferences[positions[user_id], code] = weight
+
+        all_interactions = self._load_interactions(user_ids)
+        interactions = [i for i in all_interactions if i.story_id in story_index]
+        users = np.array([positions[i.user_id] for i in interactions],
+                         dtype=np.int64)
+        story_rows = np.array([story_index[i.story_id] for i in interactions],
+                              dtype=np.int64)
+        positive = np.array([i.is_positive for i in interactions], dtype=bool)
+
+        # Each user has at most one interaction per story, so the positive
+        # ratio over recent interactions is either 0 or 1
+        recent_cutoff = datetime.utcnow() - timedelta(days=30)
+        recent = positive & np.array(
+            [i.created_at >= recent_cutoff for i in interactions], dtype=bool)
+        recent_positive = sparse.csr_matrix(
+            (np.ones(np.count_nonzero(recent)),
+             (users[recent], story_rows[recent])),
+            shape=(n_users, n_stories))
+
+        # Counted over every interaction, including stories that are newer
+        # than the snapshot, as long as the author is known to it
+        author_interactions = [i for i in all_interactions
+                               if i.author in columns.author_index]
+        n_authors = len(columns.authors)
+        author_keys = np.array(
+            [positions[i.user_id] * n_authors + columns.author_index[i.author]
+             for i in author_interactions], dtype=np.int64)
+        keys, inverse, totals = np.unique(
+            author_keys, return_inverse=True, return_counts=True)
+        positives = np.bincount(inverse, minlength=len(keys), weights=np.array(
+            [i.is_positive for i in author_interactions], dtype=float))
+        author_ratio = sparse.csr_matrix(
+            (positives / totals, (keys // n_authors, keys % n_authors)),
+            shape=(n_users, n_authors))
+
+        liked = sparse.csr_matrix(
+            (np.ones(np.count_nonzero(positive)),
+             (users[positive], story_rows[positive])),
+            shape=(n_users, n_stories))
+
+        return UserSignals(preferences, recent_positive, author_ratio, liked)
 
     def process_feedback(self, user_id, story_id, is_positive, section):
         """Process user feedback and update preferences"""
-        if not current_app:
+        self.process_feedback_batch([(user_id, story_id, is_positive)])
+
+    def process_feedback_batch(self, events):
+        """Apply ``(user_id, story_id, is_positive)`` feedback events with one commit.
+
+        Events are applied in order. Each (user, story) pair keeps only its
+        latest interaction, while every event still moves the story's
+        category preference by one step, as if the events had been processed
+        one at a time. Existing rows are loaded with a few chunked queries
+        rather than per event.
+        """
+        if not current_app or not events:
             return
 
-        # Get or create user interaction
-        interaction = UserInteraction.query.filter_by(
-            user_id=user_id,
-            story_id=story_id
-        ).first()
-
-        if not interaction:
-            interaction = UserInteraction(
-                user_id=user_id,
-                story_id=story_id,
-                is_positive=is_positive,
-                interaction_type='feedback'
-            )
-            db.session.add(interaction)
-        else:
-            interaction.is_positive = is_positive
-            interaction.created_at = datetime.utcnow()
+        now = datetime.utcnow()
+        events = [(int(user_id), int(story_id), bool(is_positive))
+                  for user_id, story_id, is_positive in events]
+        latest = {(user_id, story_id): is_positive
+                  for user_id, story_id, is_positive in events}
+        pairs = list(latest)
+        user_ids = sorted({user_id for user_id, _ in pairs})
+        story_ids = sorted({story_id for _, story_id in pairs})
 
-        # Update user preferences
-        user = User.query.get(user_id)
-        story = Story.query.get(story_id)
+        # Looked up through the (user_id, story_id) unique index; SQLite
+        # scans the table for a row-value IN over the same pairs
+        interactions = {}
+        for start in range(0, len(pairs), QUERY_CHUNK_SIZE):
+            chunk = pairs[start:start + QUERY_CHUNK_SIZE]
+            for interaction in UserInteraction.query.filter(
+                    UserInteraction.user_id.in_({uid for uid, _ in chunk}),
+                    UserInteraction.story_id.in_({sid for _, sid in chunk})):
+                interactions[(interaction.user_id, interaction.story_id)] = interaction
 
-        if user and story:
-            if story.category not in user.preferences:
-                # Initial preference
-                user.preferences[story.category] = 'medium'
-
-            # Update preference based on feedback
-            if is_positive:
-                current_pref = user.preferences[story.category]
-                if current_pref == 'low':
-                    user.preferences[story.category] = 'medium'
-                elif current_pref == 'medium':
-                    user.preferences[story.category] = 'high'
+        # Get or create user interactions
+        for (user_id, story_id), is_positive in latest.items():
+            interaction = interactions.get((user_id, story_id))
+            if not interaction:
+                db.session.add(UserInteraction(
+                    user_id=user_id,
+                    story_id=story_id,
+                    is_positive=is_positive,
+                    interaction_type='feedback',
+                    created_at=now
+                ))
             else:
-                current_pref = user.preferences[story.category]
-                if current_pref == 'high':
-                    user.preferences[story.category] = 'medium'
-                elif current_pref == 'medium':
-                    user.preferences[story.category] = 'low'
+                interaction.is_positive = is_positive
+                interaction.created_at = now
+
+        # Update user preferences for known users and stories
+        known_users = set()
+        story_categories = {}
+        for start in range(0, len(user_ids), QUERY_CHUNK_SIZE):
+            known_users.update(uid for (uid,) in db.session.query(User.id).filter(
+                User.id.in_(user_ids[start:start + QUERY_CHUNK_SIZE])))
+        for start in range(0, len(story_ids), QUERY_CHUNK_SIZE):
+            story_categories.update(db.session.query(Story.id, Story.category).filter(
+                Story.id.in_(story_ids[start:start + QUERY_CHUNK_SIZE])))
+
+        preferences = {}
+        for start in range(0, len(user_ids), QUERY_CHUNK_SIZE):
+            for preference in UserPreference.query.filter(
+                    UserPreference.user_id.in_(user_ids[start:start + QUERY_CHUNK_SIZE])):
+                preferences.setdefault(
+                    (preference.user_id, preference.category), preference)
+
+        for user_id, story_id, is_positive in events:
+            category = story_categories.get(story_id)
+            if user_id not in known_users or category is None:
+                continue
 
+            preference = preferences.get((user_id, category))
+            if not preference:
+                # Initial preference
+                preference = UserPreference(
+                    user_id=user_id, category=category,
+                    weight=DEFAULT_PREFERENCE_WEIGHT)
+                db.session.add(preference)
+                preferences[(user_id, category)] = preference
+
+            # Update preference based on feedback, one level per step.
+            # Weights stored out of range, such as imported ones, are
+            # clamped first so every step moves in the right direction.
+            weight = clamp_weight(preference.weight)
+            preference.weight = clamp_weight(
+                weight * 2 if is_positive else weight / 2)
+            preference.last_updated = now
+
+        # Precomputed rankings and cached responses no longer reflect
+        # these users
+        for start in range(0, len(user_ids), QUERY_CHUNK_SIZE):
+            chunk = user_ids[start:start + QUERY_CHUNK_SIZE]
+            materialized.invalidate_users(chunk)
+            touch_users(chunk, now)
         db.session.commit()
+        for user_id in user_ids:
+            self.invalidate_user(user_id)
 
         # Update the model periodically
-        if not self.last_update or (datetime.now() - self.last_update).days >= 1:
-            self.update_model()
+        last_update = self.last_update
+        if not last_update or (datetime.utcnow() - last_update).days >= 1:
+            self.request_refresh()
+
+
+class ModelRefreshWorker(threading.Thread):
+    """Background thread that keeps a StoryRecommender's model snapshot fresh.
+
+    The worker rebuilds the model every ``interval`` seconds, or sooner when
+    woken through ``wake()``, so that requests never pay for a rebuild. On
+    its own timer it also rebuilds the candidate index, which follows
+    popularity.
+    """
+
+    def __init__(self, app, recommender, interval, on_refresh=None):
+        super().__init__(name='model-refresh', daemon=True)
+        self.app = app
+        self.recommender = recommender
+        self.interval = interval
+        self.on_refresh = on_refresh
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+
+    def wake(self):
+        self._wake_event.set()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake_event.set()
+
+    def run(self):
+        candidate_interval = self.recommender.candidate_refresh_interval
+        next_model = time.monotonic()
+        # A model update builds the index of a new snapshot itself
+        next_candidates = time.monotonic() + candidate_interval \
+            if candidate_interval > 0 else math.inf
+        woken = False
+        while not self._stop_event.is_set():
+            now = time.monotonic()
+            if woken or now >= next_model:
+                next_model = now + self.interval
+                try:
+                    with self.app.app_context():
+                        self.recommender.update_model(incremental=True)
+                        if self.on_refresh is not None:
+                            self.on_refresh()
+                except Exception as e:
+                    print(f"Error refreshing model: {str(e)}")
+
+            if now >= next_candidates:
+                next_candidates = now + candidate_interval
+                try:
+                    with self.app.app_context():
+                        self.recommender.refresh_candidate_index()
+                except Exception as e:
+                    print(f"Error refreshing candidate index: {str(e)}")
+
+            woken = self._wake_event.wait(
+                max(0.0, min(next_model, next_candidates) - time.monotonic()))
+            self._wake_event.clear()
@@ -1,21 +1,82 @@
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, Response, jsonify, request, send_from_directory
 from flask_cors import CORS
 from models import db, Story, User, UserInteraction
-from ai_model import StoryRecommender
+from ai_model import (StoryRecommender, load_preference_weights,
+                      preference_level, preference_weight,
+                      save_preference_weights, touch_users)
+from catalog import (StoryCatalog, iter_stories, load_story_cards,
+                     personalized_sections, section_items, stories_version)
+from conditional import add_validators, make_etag, not_modified
+from config import Config
+from feedback_queue import FeedbackConsumer, FeedbackJournal
+from instrumentation import RequestMetrics, stage
+from scoring_pool import ScoringPool
+from streaming import json_array_response, ndjson_response, wants_ndjson
+from database import read_session
+import database
+import instrumentation
+import query_budget
+import materialized
+import migrations
+import json
 import os
 
 app = Flask(__name__, static_folder='static')
 # Allow CORS from all origins
 CORS(app)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///storymorph.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-db.init_app(app)
-recommender = StoryRecommender()
+database.init_app(app)
+
+# Stage timings and SQL counts of every request, reported in a
+# Server-Timing header and aggregated for /metrics
+request_metrics = RequestMetrics()
+instrumentation.init_app(
+    app, request_metrics, Config.SLOW_REQUEST_PROFILE_MS,
+    Config.PROFILE_INTERVAL_MS, Config.PROFILE_DIR)
+query_budget.init_app(
+    app, query_budget.parse_budgets(Config.SQL_QUERY_BUDGETS),
+    query_budget.parse_budgets(Config.SQL_TIME_BUDGETS_MS),
+    Config.SQL_BUDGET_STRICT)
+recommender = StoryRecommender(
+    vocabulary_drift_threshold=Config.VOCABULARY_DRIFT_THRESHOLD,
+    artifact_dir=Config.MODEL_ARTIFACT_DIR,
+    cache_size=Config.RECOMMENDATION_CACHE_SIZE,
+    cache_ttl=Config.RECOMMENDATION_CACHE_TTL,
+    candidate_pool_size=Config.CANDIDATE_POOL_SIZE,
+    exact_scoring_limit=Config.EXACT_SCORING_LIMIT,
+    candidate_refresh_interval=Config.CANDIDATE_INDEX_REFRESH_INTERVAL)
+
+# Batch scoring runs in worker processes when a pool is configured
+scoring_pool = ScoringPool(
+    recommender, Config.SCORING_POOL_SIZE) if Config.SCORING_POOL_SIZE else None
+
+# Largest number of users accepted by /api/recommendations/batch
+MAX_BATCH_USERS = 1000
+
+# Largest value an SQLite INTEGER column holds
+MAX_ID = 2 ** 63 - 1
 
 # Create database tables
 with app.app_context():
     db.create_all()
+    migrations.upgrade()
+    catalog = StoryCatalog.from_database()
+
+
+def reload_catalog():
+    """Rebuild the story catalog and swap it in for new requests"""
+    global catalog
+    catalog = StoryCatalog.from_database()
+
+
+# Build and refresh the recommendation model off the request path
+recommender.start_refresh_worker(
+    app, Config.MODEL_REFRESH_INTERVAL, on_refresh=reload_catalog)
+
+# Feedback is acknowledged once journaled and applied in batches
+feedback_journal = FeedbackJournal(Config.FEEDBACK_JOURNAL_PATH)
+feedback_consumer = FeedbackConsumer(
+    app, feedback_journal, recommender, Config.FEEDBACK_FLUSH_INTERVAL)
+feedback_consumer.start()
 
 
 @app.route('/')
@@ -23,20 +84,33 @@ def index():
     return send_from_directory('docs', 'index.html')
 
 
+@app.route('/metrics')
+def metrics():
+    """Request, stage and SQL histograms of this process, in the Prometheus text format"""
+    return Response(request_metrics.render(),
+                    mimetype='text/plain; version=0.0.4')
+
+
+# Fixed set of 4 users
+DEMO_USERS = [
+    {'id': 1, 'username': 'Alex', 'preferences': {'Fiction': 'high', 'Self-Help': 'medium',
+                                                  'Mystery': 'low', 'Romance': 'medium', 'History': 'low', 'Business': 'high'}},
+    {'id': 2, 'username': 'Taylor', 'preferences': {'Fiction': 'medium', 'Self-Help': 'high',
+                                                    'Mystery': 'medium', 'Romance': 'high', 'History': 'medium', 'Business': 'low'}},
+    {'id': 3, 'username': 'Jordan', 'preferences': {'Fiction': 'low', 'Self-Help': 'high',
+                                                    'Mystery': 'high', 'Romance': 'low', 'History': 'high', 'Business': 'medium'}},
+    {'id': 4, 'username': 'Morgan', 'preferences': {'Fiction': 'high', 'Self-Help': 'low',
+                                                    'Mystery': 'medium', 'Romance': 'high', 'History': 'medium', 'Business': 'high'}}
+]
+DEMO_USERS_ETAG = make_etag('users', json.dumps(DEMO_USERS, sort_keys=True))
+
+
 @app.route('/api/users')
 def get_users():
-    # Fixed set of 4 users
-    users = [
-        {'id': 1, 'username': 'Alex', 'preferences': {'Fiction': 'high', 'Self-Help': 'medium',
-                                                      'Mystery': 'low', 'Romance': 'medium', 'History': 'low', 'Business': 'high'}},
-        {'id': 2, 'username': 'Taylor', 'preferences': {'Fiction': 'medium', 'Self-Help': 'high',
-                                                        'Mystery': 'medium', 'Romance': 'high', 'History': 'medium', 'Business': 'low'}},
-        {'id': 3, 'username': 'Jordan', 'preferences': {'Fiction': 'low', 'Self-Help': 'high',
-                                                        'Mystery': 'high', 'Romance': 'low', 'History': 'high', 'Business': 'medium'}},
-        {'id': 4, 'username': 'Morgan', 'preferences': {'Fiction': 'high', 'Self-Help': 'low',
-                                                        'Mystery': 'medium', 'Romance': 'high', 'History': 'medium', 'Business': 'high'}}
-    ]
-    return jsonify(users)
+    cached = not_modified(DEMO_USERS_ETAG)
+    if cached:
+        return cached
+    return add_validators(jsonify(DEMO_USERS), DEMO_USERS_ETAG)
 
 
 @app.route('/api/recommendations', methods=['GET', 'POST'])
@@ -54,274 +128,159 @@ def get_recommendations():
     recommendation_type = request.args.get('type', 'all')
 
     try:
-        # Sample stories for testing
-        sample_stories = [
-            {
-                'id': 1,
-                'title': 'The Silent Patient',
-                'author': 'Alex Michaelides',
-                'category': 'Mystery',
-                'match_score': 98,
-                'cover_image': '/static/placeholder.jpg'
-            },
-            {
-                'id': 2,
-                'title': 'Atomic Habits',
-                'author': 'James Clear',
-                'category': 'Self-Help',
-                'match_score': 95,
-                'cover_image': '/static/placeholder.jpg'
-            },
-            {
-                'id': 3,
-                'title': 'Project Hail Mary',
-                'author': 'Andy Weir',
-                'category': 'Fiction',
-                'match_score': 94,
-                'cover_image': '/static/placeholder.jpg'
-            },
-            {
-                'id': 4,
-                'title': 'The Midnight Library',
-                'author': 'Matt Haig',
-                'category': 'Fiction',
-                'match_score': 92,
-                'cover_image': '/static/placeholder.jpg'
-            },
-            {
-                'id': 5,
-                'title': 'Where the Crawdads Sing',
-                'author': 'Delia Owens',
-                'category': 'Fiction',
-                'match_score': 90,
-                'cover_image': '/static/placeholder.jpg'
-            },
-            {
-                'id': 6,
-                'title': 'Educated',
-                'author': 'Tara Westover',
-                'category': 'History',
-                'match_score': 88,
-                'cover_image': '/static/placeholder.jpg'
-            },
-            {
-                'id': 7,
-                'title': 'The Alchemist',
-                'author': 'Paulo Coelho',
-                'category': 'Fiction',
-                'match_score': 85,
-                'cover_image': '/static/placeholder.jpg'
-            },
-            {
-                'id': 8,
-                'title': 'The Four Agreements',
-                'author': 'Don Miguel Ruiz',
-                'category': 'Self-Help',
-                'match_score': 82,
-                'cover_image': '/static/placeholder.jpg'
-            },
-            {
-                'id': 9,
-                'title': 'The Power of Now',
-                'author': 'Eckhart Tolle',
-                'category': 'Self-Help',
-                'match_score': 80,
-                'cover_image': '/static/placeholder.jpg'
-            },
-            {
-                'id': 10,
-                'title': 'The 7 Habits of Highly Effective People',
-                'author': 'Stephen R. Covey',
-                'category': 'Business',
-                'match_score': 78,
-                'cover_image': '/static/placeholder.jpg'
-            },
-            {
-                'id': 11,
-                'title': 'The Art of War',
-                'author': 'Sun Tzu',
-                'category': 'Business',
-                'match_score': 75,
-                'cover_image': '/static/placeholder.jpg'
-            },
-            {
-                'id': 12,
-                'title': 'The Lean Startup',
-                'author': 'Eric Ries',
-                'category': 'Business',
-                'match_score': 72,
-                'cover_image': '/static/placeholder.jpg'
-            },
-            {
-                'id': 13,
-                'title': 'The Psychology of Money',
-                'author': 'Morgan Housel',
-                'category': 'Business',
-                'match_score': 70,
-                'cover_image': '/static/placeholder.jpg'
-            },
-            {
-                'id': 14,
-                'title': 'The Subtle Art of Not Giving a F*ck',
-                'author': 'Mark Manson',
-                'category': 'Self-Help',
-                'match_score': 68,
-                'cover_image': '/static/placeholder.jpg'
-            },
-            {
-                'id': 15,
-                'title': 'The 48 Laws of Power',
-                'author': 'Robert Greene',
-                'category': 'Business',
-                'match_score': 65,
-                'cover_image': '/static/placeholder.jpg'
-            },
-            {
-                'id': 16,
-                'title': 'The 5 Love Languages',
-                'author': 'Gary Chapman',
-                'category': 'Romance',
-                'match_score': 62,
-                'cover_image': '/static/placeholder.jpg'
-            },
-            {
-                'id': 17,
-                'title': 'The Road Less Traveled',
-                'author': 'M. Scott Peck',
-                'category': 'Self-Help',
-                'match_score': 60,
-                'cover_image': '/static/placeholder.jpg'
-            },
-            {
-                'id': 18,
-                'title': 'The Four Winds',
-                'author': 'Kristin Hannah',
-                'category': 'Fiction',
-                'match_score': 58,
-                'cover_image': '/static/placeholder.jpg'
-            },
-            {
-                'id': 19,
-                'title': 'Think Like a Monk',
-                'author': 'Jay Shetty',
-                'category': 'Self-Help',
-                'match_score': 96,
-                'cover_image': '/static/placeholder.jpg'
-            },
-            {
-                'id': 20,
-                'title': 'The 5 AM Club',
-                'author': 'Robin Sharma',
-                'category': 'Self-Help',
-                'match_score': 93,
-                'cover_image': '/static/placeholder.jpg'
-            },
-            {
-                'id': 21,
-                'title': 'The Miracle Morning',
-                'author': 'Hal Elrod',
-                'category': 'Self-Help',
-                'match_score': 91,
-                'cover_image': '/static/placeholder.jpg'
-            },
-            {
-                'id': 22,
-                'title': 'The Compound Effect',
-                'author': 'Darren Hardy',
-                'category': 'Self-Help',
-                'match_score': 89,
-                'cover_image': '/static/placeholder.jpg'
-            },
-            {
-                'id': 23,
-                'title': 'The One Thing',
-                'author': 'Gary Keller',
-                'category': 'Self-Help',
-                'match_score': 87,
-                'cover_image': '/static/placeholder.jpg'
-            },
-            {
-                'id': 24,
-                'title': 'Deep Work',
-                'author': 'Cal Newport',
-                'category': 'Self-Help',
-                'match_score': 85,
-                'cover_image': '/static/placeholder.jpg'
-            }
-        ]
-
-        # Sort all stories by match score
-        sample_stories.sort(key=lambda x: x['match_score'], reverse=True)
-
-        # Get the highest rated book overall for "Because You Listened" section
-        highest_rated = sample_stories[0]
-
-        # For "All" category
-        if category == 'All':
-            # Get 5 most similar books (same category as highest rated) for "Highly Recommended"
-            highly_recommended = [
-                s for s in sample_stories if s['category'] == highest_rated['category']][:5]
-
-            # Get 5 similar books for "Because You Listened" (same category as highest rated, excluding the book itself)
-            similar_books = [s for s in sample_stories if s['category'] ==
-                             highest_rated['category'] and s['id'] != highest_rated['id']][:5]
-
-            # Get 5 random books for "New Discoveries" (excluding those in highly recommended and because you listened)
-            remaining_books = [
-                s for s in sample_stories if s not in highly_recommended and s not in similar_books]
-            new_discoveries = remaining_books[:5] if len(
-                remaining_books) >= 5 else remaining_books
-
-        # For specific categories
+        # Answer revalidations from version numbers, before any scoring
+        etag, last_modified = recommendation_validators(user_id, category)
+        cached = not_modified(etag, last_modified)
+        if cached:
+            return cached
+
+        sections = None
+        if user_id:
+            stories = personalized_stories(user_id, category)
+            if stories:
+                sections = personalized_sections(
+                    stories, catalog.sections(category))
+        if sections is None:
+            sections = catalog.sections(category)
+
+        if wants_ndjson():
+            # One story per line, tagged with its section
+            response = ndjson_response(section_items(sections))
         else:
-            # Filter stories by category
-            category_stories = [
-                s for s in sample_stories if s['category'] == category]
-
-            # If we have enough books in this category
-            if len(category_stories) >= 5:
-                highly_recommended = category_stories[:5]
-                # Get similar books for "Because You Listened" (excluding the first book)
-                similar_books = category_stories[1:6]
-                new_discoveries = category_stories[6:11] if len(
-                    category_stories) >= 11 else category_stories[6:]
-            else:
-                # If not enough books in category, fill with highest rated books from other categories
-                highly_recommended = category_stories[:]
-                remaining_slots = 5 - len(highly_recommended)
-                other_books = [
-                    s for s in sample_stories if s['category'] != category]
-                highly_recommended.extend(other_books[:remaining_slots])
-
-                # For "Because You Listened", take remaining books from this category plus others
-                similar_books = []
-                if len(category_stories) > 1:
-                    similar_books = category_stories[1:]
-                remaining_slots = 5 - len(similar_books)
-                similar_books.extend(other_books[:remaining_slots])
-
-                # For new discoveries, take remaining books
-                new_discoveries = other_books[len(
-                    similar_books):len(similar_books) + 5]
-
-        # Ensure we always have books in each section
-        if not highly_recommended:
-            highly_recommended = sample_stories[:5]
-        if not similar_books:
-            similar_books = sample_stories[1:6]
-        if not new_discoveries:
-            new_discoveries = sample_stories[6:11]
+            with stage('serialize'):
+                response = jsonify(sections)
+        return add_validators(response, etag, last_modified)
+    except Exception as e:
+        print(f"Error getting recommendations: {str(e)}")
+        return jsonify({'error': str(e)}), 500
 
-        return jsonify({
-            'highly_recommended': highly_recommended,
-            'because_you_listened': similar_books,
-            'new_discoveries': new_discoveries
-        })
 
+def recommendation_validators(user_id, category):
+    """ETag and Last-Modified of a recommendations response.
+
+    They depend only on the catalog's content version, the latest change
+    to the stories and feedback it was built from, and the user's
+    interaction version. Stories also feed the model, which is refreshed
+    together with the catalog. Nothing here is specific to one process,
+    so any worker can answer a revalidation, and checking them costs one
+    primary key lookup at most.
+    """
+    parts = ['recommendations', category, wants_ndjson(),
+             catalog.version, catalog.last_modified]
+    last_modified = catalog.last_modified
+    if user_id:
+        user = read_session.query(
+            User.interaction_version, User.interactions_updated_at
+        ).filter(User.id == user_id).first()
+        parts += [user_id, user.interaction_version if user else None]
+        if user and user.interactions_updated_at:
+            last_modified = max(last_modified or user.interactions_updated_at,
+                                user.interactions_updated_at)
+    return make_etag(*parts), last_modified
+
+
+def personalized_stories(user_id, category):
+    """A user's ranked stories, read from the precomputed table when present.
+
+    Users whose feedback arrived after the last precomputation run have no
+    stored rows and are scored online instead. That stays in this thread
+    even with a scoring pool: one user's ranking is cached and, in large
+    catalogs, scored over a few hundred candidates rather than the whole
+    category.
+    """
+    with stage('materialized'):
+        stories = materialized.load_stories(user_id, category)
+    if stories is None:
+        ranked = recommender.get_top_scores(
+            user_id, category, materialized.TOP_N)
+        with stage('records'):
+            stories = load_story_cards(ranked)
+    return stories
+
+
+@app.route('/api/catalog/export')
+def export_catalog():
+    """Stream every story, optionally limited to one category.
+
+    Responds with NDJSON when asked for it, otherwise with a JSON array
+    that is encoded and sent one story at a time.
+    """
+    category = request.args.get('category', 'All')
+    count, last_modified = stories_version(category)
+    etag = make_etag('export', category, wants_ndjson(), count, last_modified)
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return cached
+
+    stories = iter_stories(category)
+    if wants_ndjson():
+        response = ndjson_response(stories)
+    else:
+        response = json_array_response(stories)
+    return add_validators(response, etag, last_modified)
+
+
+@app.route('/api/recommendations/page')
+def get_recommendations_page():
+    user_id = request.args.get('user_id')
+    category = request.args.get('category', 'All')
+    cursor = request.args.get('cursor')
+    page_size = request.args.get('page_size', 6, type=int)
+
+    if not user_id:
+        return jsonify({'error': 'User ID is required'}), 400
+    if not 1 <= page_size <= 50:
+        return jsonify({'error': 'page_size must be between 1 and 50'}), 400
+
+    try:
+        stories, next_cursor = recommender.get_recommendations_page(
+            user_id, category, cursor, page_size)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f"Error getting recommendations: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+    return jsonify({
+        'stories': stories,
+        'next_cursor': next_cursor
+    })
+
+
+@app.route('/api/recommendations/batch', methods=['POST'])
+def get_recommendations_batch():
+    data = request.json
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Request body must be a JSON object'}), 400
+    user_ids = data.get('user_ids')
+    category = data.get('category', 'All')
+    limit = data.get('limit', 6)
+
+    if not isinstance(user_ids, list) or not user_ids:
+        return jsonify({'error': 'user_ids must be a non-empty list'}), 400
+    if len(user_ids) > MAX_BATCH_USERS:
+        return jsonify({'error': f'At most {MAX_BATCH_USERS} users per batch'}), 400
+    if not all(isinstance(uid, int) and not isinstance(uid, bool) for uid in user_ids):
+        return jsonify({'error': 'user_ids must be integers'}), 400
+    if not isinstance(limit, int) or isinstance(limit, bool) or not 1 <= limit <= 50:
+        return jsonify({'error': 'limit must be between 1 and 50'}), 400
+
+    try:
+        if scoring_pool:
+            recommendations = recommender.format_ranked(
+                scoring_pool.rank_batch(user_ids, category, limit))
+        else:
+            recommendations = recommender.get_recommendations_batch(
+                user_ids, category, limit)
+    except Exception as e:
+        print(f"Error getting batch recommendations: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+    return jsonify({
+        'recommendations': {str(uid): stories for uid, stories in recommendations.items()},
+        'category': category
+    })
+
 
 @app.route('/api/feedback', methods=['POST'])
 def handle_feedback():
@@ -333,25 +292,52 @@ def handle_feedback():
 
     if not all([user_id, story_id, is_positive is not None]):
         return jsonify({'status': 'error', 'message': 'Missing required fields'}), 400
+    # Checked before journaling: an event the consumer cannot write would
+    # only be found, and dead-lettered, after the client was told success
+    user_id, story_id = parse_id(user_id), parse_id(story_id)
+    if user_id is None or story_id is None:
+        return jsonify({'status': 'error', 'message': 'user_id and story_id must be positive integers'}), 400
+    if not isinstance(is_positive, bool):
+        return jsonify({'status': 'error', 'message': 'is_positive must be true or false'}), 400
+    if section is not None and not isinstance(section, str):
+        return jsonify({'status': 'error', 'message': 'section must be a string'}), 400
 
     try:
-        recommender.process_feedback(user_id, story_id, is_positive, section)
+        feedback_journal.append(user_id, story_id, is_positive, section)
         return jsonify({'status': 'success'})
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 
+def parse_id(value):
+    """A row id from a JSON integer or a string of digits, or None if it is not one"""
+    if isinstance(value, str) and value.isascii() and value.isdigit():
+        value = int(value)
+    if isinstance(value, int) and not isinstance(value, bool) and 0 < value <= MAX_ID:
+        return value
+    return None
+
+
 @app.route('/api/users/<int:user_id>')
 def get_user(user_id):
     user = User.query.get(user_id)
     if not user:
         return jsonify({'error': 'User not found'}), 404
 
-    return jsonify({
+    etag = make_etag('user', user.id, user.interaction_version)
+    last_modified = user.interactions_updated_at or user.created_at
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return cached
+
+    weights = load_preference_weights(user.id)
+    return add_validators(jsonify({
         'id': user.id,
         'username': user.username,
-        'preferences': user.preferences
-    })
+        'preferences': {category: preference_level(weight)
+                        for category, weight in weights.items()},
+        'preference_weights': weights
+    }), etag, last_modified)
 
 
 @app.route('/api/users/<int:user_id>/preferences', methods=['PUT'])
@@ -365,10 +351,23 @@ def update_user_preferences(user_id):
 
     if not preferences:
         return jsonify({'error': 'Preferences data is required'}), 400
+    if not isinstance(preferences, dict):
+        return jsonify({'error': 'Preferences must map categories to levels or weights'}), 400
+
+    # Accept 'high'/'medium'/'low' labels or numeric weights
+    weights = {category: preference_weight(value)
+               for category, value in preferences.items()}
+    invalid = [category for category, weight in weights.items()
+               if weight is None]
+    if invalid:
+        return jsonify({'error': f"Invalid preference for: {', '.join(invalid)}"}), 400
 
     try:
-        user.preferences = preferences
+        save_preference_weights(user_id, weights)
+        materialized.invalidate_users([user_id])
+        touch_users([user_id])
         db.session.commit()
+        recommender.invalidate_user(user_id)
         return jsonify({'status': 'success'})
     except Exception as e:
         db.session.rollback()
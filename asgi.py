@@ -0,0 +1,31 @@
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from app import app
+from config import Config
+
+# The event loop owns every connection, so idle keep-alive and slow
+# clients cost no thread. Requests run the Flask routes in app.py on a
+# bounded thread pool; batch scoring moves on to the SCORING_POOL_SIZE processes.
+executor = ThreadPoolExecutor(
+    Config.ASGI_THREADS, thread_name_prefix='asgi-request')
+
+
+class PooledWsgiToAsgiInstance(WsgiToAsgiInstance):
+    """One request to the WSGI app, run on the request thread pool.
+
+    asgiref runs WSGI apps thread-sensitively, which puts every request
+    of the process on one shared thread, one after another.
+    """
+
+    run_wsgi_app = sync_to_async(
+        WsgiToAsgiInstance.run_wsgi_app.__wrapped__,
+        thread_sensitive=False, executor=executor)
+
+
+class PooledWsgiToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await PooledWsgiToAsgiInstance(self.wsgi_application)(scope, receive, send)
+
+
+application = PooledWsgiToAsgi(app)
@@ -0,0 +1,372 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from flask import Flask
+from extensions import db
+from models import Story, User, UserInteraction, UserPreference
+from ai_model import PREFERENCE_WEIGHTS, StoryRecommender
+from config import Config
+import database
+import migrations
+from bulk_import import import_rows
+from utils import calculate_match_score, calculate_match_scores
+
+CATEGORIES = ['Fiction', 'Self-Help', 'Mystery', 'Romance', 'History', 'Business']
+RESULTS_FILE = 'benchmark_results.json'
+DATA_DIR = 'benchmark_data'
+# Words that generated titles and descriptions are drawn from
+VOCABULARY_SIZE = 5000
+
+
+class Scale:
+    """Size of a synthetic dataset, written as users:stories:interactions_per_user"""
+
+    def __init__(self, spec):
+        self.users, self.stories, self.interactions_per_user = (
+            int(part) for part in spec.split(':'))
+        self.spec = spec
+
+    def as_dict(self):
+        return {
+            'users': self.users,
+            'stories': self.stories,
+            'interactions_per_user': self.interactions_per_user,
+        }
+
+
+def story_rows(rng, first_id, count, n_authors, now):
+    """Generate ``count`` story rows starting at id ``first_id``"""
+    for story_id in range(first_id, first_id + count):
+        words = rng.choices(range(VOCABULARY_SIZE), k=24)
+        created_at = now - timedelta(seconds=rng.randrange(365 * 86400))
+        yield {
+            'id': story_id,
+            'title': ' '.join(f'w{word}' for word in words[:4]),
+            'author': f'Author {rng.randrange(n_authors)}',
+            'category': rng.choice(CATEGORIES),
+            'description': ' '.join(f'w{word}' for word in words[4:]),
+            'created_at': created_at,
+            'updated_at': created_at,
+        }
+
+
+def user_rows(scale):
+    for user_id in range(1, scale.users + 1):
+        yield {
+            'id': user_id,
+            'username': f'user{user_id}',
+            'email': f'user{user_id}@example.com',
+        }
+
+
+def preference_rows(rng, scale, now):
+    weights = list(PREFERENCE_WEIGHTS.values())
+    for user_id in range(1, scale.users + 1):
+        for category in CATEGORIES:
+            yield {
+                'user_id': user_id,
+                'category': category,
+                'weight': rng.choice(weights),
+                'last_updated': now,
+            }
+
+
+def interaction_rows(rng, scale, now):
+    per_user = min(scale.interactions_per_user, scale.stories)
+    for user_id in range(1, scale.users + 1):
+        for story_id in rng.sample(range(1, scale.stories + 1), per_user):
+            yield {
+                'user_id': user_id,
+                'story_id': story_id,
+                'is_positive': rng.random() < 0.7,
+                'interaction_type': 'feedback',
+                'created_at': now - timedelta(seconds=rng.randrange(60 * 86400)),
+            }
+
+
+def generate_dataset(path, scale, seed):
+    """Write a synthetic dataset of ``scale`` to a new SQLite file at ``path``.
+
+    The same scale and seed always produce the same rows.
+    """
+    rng = random.Random(seed)
+    now = datetime(2024, 1, 1)
+    app = create_app(path)
+    started = time.perf_counter()
+    with app.app_context():
+        db.create_all()
+        migrations.upgrade()
+        counts = {
+            'users': import_rows(User.__table__, user_rows(scale)),
+            'preferences': import_rows(UserPreference.__table__,
+                                       preference_rows(rng, scale, now)),
+            'stories': import_rows(Story.__table__, story_rows(
+                rng, 1, scale.stories, max(1, scale.stories // 10), now)),
+            'interactions': import_rows(UserInteraction.__table__,
+                                        interaction_rows(rng, scale, now)),
+        }
+    dispose(app)
+    elapsed = time.perf_counter() - started
+    print(f"Generated {counts} in {elapsed:.1f}s")
+
+
+def create_app(path):
+    app = Flask(__name__)
+    database.init_app(app, f'sqlite:///{os.path.abspath(path)}')
+    return app
+
+
+def dispose(app):
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+def summarize(latencies, elapsed):
+    """Latency percentiles in milliseconds and operations per second"""
+    latencies = np.array(latencies) * 1000
+    return {
+        'count': len(latencies),
+        'p50_ms': round(float(np.percentile(latencies, 50)), 3),
+        'p95_ms': round(float(np.percentile(latencies, 95)), 3),
+        'p99_ms': round(float(np.percentile(latencies, 99)), 3),
+        'mean_ms': round(float(latencies.mean()), 3),
+        'max_ms': round(float(latencies.max()), 3),
+        'throughput_per_s': round(len(latencies) / elapsed, 2) if elapsed else None,
+    }
+
+
+def measure(app, run, samples, prepare=None):
+    """Time ``run(*sample)`` for each sample, each in its own app context.
+
+    ``prepare(*sample)`` runs before the timer starts.
+    """
+    latencies = []
+    for sample in samples:
+        with app.app_context():
+            if prepare:
+                prepare(*sample)
+            started = time.perf_counter()
+            run(*sample)
+            latencies.append(time.perf_counter() - started)
+    return summarize(latencies, sum(latencies))
+
+
+def run_scale(scale, args):
+    """Benchmark every operation against one dataset size"""
+    source = os.path.join(args.data_dir, f'bench_{scale.spec.replace(":", "_")}_{args.seed}.db')
+    if not os.path.exists(source):
+        os.makedirs(args.data_dir, exist_ok=True)
+        generate_dataset(source, scale, args.seed)
+
+    results = {}
+    # Feedback and model updates write, so each run works on a copy
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'benchmark.db')
+        with sqlite3.connect(source) as original, sqlite3.connect(path) as copy:
+            original.backup(copy)
+
+        app = create_app(path)
+        recommender = StoryRecommender(
+            vocabulary_drift_threshold=Config.VOCABULARY_DRIFT_THRESHOLD,
+            cache_size=Config.RECOMMENDATION_CACHE_SIZE,
+            cache_ttl=Config.RECOMMENDATION_CACHE_TTL,
+            candidate_pool_size=Config.CANDIDATE_POOL_SIZE,
+            exact_scoring_limit=Config.EXACT_SCORING_LIMIT)
+        rng = random.Random(args.seed)
+
+        print(f"[{scale.spec}] update_model (full)")
+        results['update_model_full'] = measure(
+            app, lambda: recommender.update_model(), [()])
+
+        print(f"[{scale.spec}] update_model (incremental)")
+        next_id = [scale.stories + 1]
+
+        def add_stories():
+            # Stamped as just written, which is how the incremental
+            # update finds new stories
+            now = datetime.utcnow()
+            import_rows(Story.__table__, (dict(row, updated_at=now) for row in story_rows(
+                rng, next_id[0], args.new_stories,
+                max(1, scale.stories // 10), now)), report=False)
+            next_id[0] += args.new_stories
+
+        results['update_model_incremental'] = measure(
+            app, lambda: recommender.update_model(incremental=True),
+            [()] * args.updates, prepare=add_stories)
+
+        print(f"[{scale.spec}] get_recommendations")
+        categories = ['All'] + CATEGORIES
+        requests = [(rng.randint(1, scale.users), rng.choice(categories))
+                    for _ in range(args.requests)]
+        # Cached rankings are dropped first, so every call scores
+        results['get_recommendations'] = measure(
+            app, lambda user_id, category: recommender.get_recommendations(
+                user_id, category, 'highly_recommended'),
+            requests, prepare=lambda user_id, category:
+                recommender.invalidate_user(user_id))
+
+        print(f"[{scale.spec}] process_feedback")
+        events = [(rng.randint(1, scale.users), rng.randint(1, scale.stories),
+                   rng.random() < 0.7) for _ in range(args.feedback)]
+        results['process_feedback'] = measure(
+            app, lambda user_id, story_id, is_positive: recommender.process_feedback(
+                user_id, story_id, is_positive, 'highly_recommended'),
+            events)
+
+        dispose(app)
+    return results
+
+
+def run_match_scores(spec, args):
+    """Time calculate_match_score pair by pair against calculate_match_scores.
+
+    ``spec`` is users:stories. Users weight every category and each story
+    has one, as in the database. The per-pair function is timed on a
+    sample of ``args.match_pairs`` pairs, whose scores must equal the
+    batched ones.
+    """
+    users, stories = (int(part) for part in spec.split(':'))
+    rng = np.random.default_rng(args.seed)
+    weights = rng.choice(list(PREFERENCE_WEIGHTS.values()), size=(users, len(CATEGORIES)))
+    story_categories = rng.integers(len(CATEGORIES), size=stories)
+    features = np.zeros((stories, len(CATEGORIES)))
+    features[np.arange(stories), story_categories] = 1
+
+    print(f"[match:{spec}] calculate_match_scores")
+    latencies = []
+    for _ in range(args.match_repeats):
+        started = time.perf_counter()
+        scores = calculate_match_scores(weights, features)
+        latencies.append(time.perf_counter() - started)
+    batched = summarize(latencies, sum(latencies))
+    batched['pairs_per_s'] = round(users * stories / batched['mean_ms'] * 1000)
+
+    print(f"[match:{spec}] calculate_match_score")
+    latencies = []
+    mismatches = 0
+    for _ in range(args.match_pairs):
+        user, story = rng.integers(users), rng.integers(stories)
+        preferences = [UserPreference(category=category, weight=weight)
+                       for category, weight in zip(CATEGORIES, weights[user].tolist())]
+        story_features = [preferences[story_categories[story]]]
+        started = time.perf_counter()
+        score = calculate_match_score(preferences, story_features)
+        latencies.append(time.perf_counter() - started)
+        mismatches += score != scores[user, story]
+    per_pair = summarize(latencies, sum(latencies))
+    per_pair['pairs_per_s'] = per_pair['throughput_per_s']
+    if mismatches:
+        print(f"  {mismatches} of {args.match_pairs} scores differ between the two")
+    print(f"  {batched['pairs_per_s'] / per_pair['pairs_per_s']:.0f}x the pairs per second")
+    return {'calculate_match_scores': batched, 'calculate_match_score': per_pair}
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path, max_regression):
+    """Print p95 changes against a baseline run; returns the number of regressions"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {(run['scale'], run['operation']): run for run in baseline['runs']}
+
+    regressions = 0
+    print(f"p95 against {baseline_path} (revision {baseline.get('revision')}):")
+    for run in results['runs']:
+        before = previous.get((run['scale'], run['operation']))
+        if before is None or not before['p95_ms']:
+            continue
+        ratio = run['p95_ms'] / before['p95_ms']
+        regressed = ratio > max_regression
+        regressions += regressed
+        print(f"  {'REGRESSION ' if regressed else ''}{run['scale']} {run['operation']}: "
+              f"{before['p95_ms']:.2f}ms -> {run['p95_ms']:.2f}ms ({ratio:.2f}x)")
+    return regressions
+
+
+def main(args):
+    results = {
+        'revision': git_revision(),
+        'started_at': datetime.utcnow().isoformat(),
+        'seed': args.seed,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'runs': [],
+    }
+    for spec in args.scale:
+        scale = Scale(spec)
+        for operation, summary in run_scale(scale, args).items():
+            results['runs'].append(dict(
+                scale=scale.spec, operation=operation, **scale.as_dict(), **summary))
+            print(f"  {operation}: p50 {summary['p50_ms']:.2f}ms, "
+                  f"p95 {summary['p95_ms']:.2f}ms, p99 {summary['p99_ms']:.2f}ms, "
+                  f"{summary['throughput_per_s']}/s")
+    for spec in args.match_scores:
+        for operation, summary in run_match_scores(spec, args).items():
+            results['runs'].append(dict(scale=f'match:{spec}', operation=operation, **summary))
+            print(f"  {operation}: p50 {summary['p50_ms']:.3f}ms, "
+                  f"{summary['pairs_per_s']} pairs/s")
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote {args.output}")
+
+    if args.baseline:
+        return 1 if compare(results, args.baseline, args.max_regression) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Measure recommender latency on synthetic datasets')
+    parser.add_argument('--scale', action='append',
+                        help='users:stories:interactions_per_user; repeat for '
+                             'several sizes (default 100:1000:20 and 1000:10000:50)')
+    parser.add_argument('--seed', type=int, default=42,
+                        help='seed for generated data and request samples')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='get_recommendations calls per scale')
+    parser.add_argument('--feedback', type=int, default=200,
+                        help='process_feedback calls per scale')
+    parser.add_argument('--updates', type=int, default=5,
+                        help='incremental update_model calls per scale')
+    parser.add_argument('--new-stories', type=int, default=10,
+                        help='stories added before each incremental update')
+    parser.add_argument('--match-scores', action='append', default=[],
+                        help='users:stories; also time match scoring at this '
+                             'size, per pair and batched')
+    parser.add_argument('--match-pairs', type=int, default=2000,
+                        help='pairs scored one at a time per match scoring size')
+    parser.add_argument('--match-repeats', type=int, default=5,
+                        help='batched calls per match scoring size')
+    parser.add_argument('--data-dir', default=DATA_DIR,
+                        help='where generated datasets are kept for reuse')
+    parser.add_argument('--output', default=RESULTS_FILE,
+                        help='JSON file the results are written to')
+    parser.add_argument('--baseline',
+                        help='results of an earlier run to compare p95 against')
+    parser.add_argument('--max-regression', type=float, default=1.2,
+                        help='p95 ratio over the baseline that fails the run')
+    args = parser.parse_args()
+    # Only match scoring runs when it is asked for on its own
+    if args.scale is None:
+        args.scale = [] if args.match_scores else ['100:1000:20', '1000:10000:50']
+    sys.exit(main(args))
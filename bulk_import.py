@@ -0,0 +1,220 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import Boolean, DateTime, Float, Integer, JSON
+from extensions import db
+import database
+import migrations
+from models import (MaterializedRecommendation, Story, User, UserInteraction,
+                    UserPreference)
+from ai_model import QUERY_CHUNK_SIZE, touch_users
+import materialized
+
+# Tables that can be imported, in foreign key order
+TABLES = {
+    'users': User.__table__,
+    'stories': Story.__table__,
+    'preferences': UserPreference.__table__,
+    'interactions': UserInteraction.__table__,
+}
+
+# Rows written per executemany and per transaction
+CHUNK_SIZE = 10_000
+
+
+def read_rows(path):
+    """Stream rows from a CSV file with a header line, or an NDJSON file"""
+    if path.endswith(('.ndjson', '.jsonl')):
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    elif path.endswith('.csv'):
+        with open(path, newline='') as f:
+            yield from csv.DictReader(f)
+    else:
+        raise ValueError(f"Unsupported file type: {path} (expected .csv or .ndjson)")
+
+
+def parse_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 't', 'yes', 'y')
+    return bool(value)
+
+
+def parse_datetime(value):
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).replace(tzinfo=None)
+
+
+def parse_json(value):
+    return json.loads(value) if isinstance(value, str) else value
+
+
+def column_parsers(table):
+    """Functions turning text or JSON values into each column's Python type"""
+    parsers = {}
+    for column in table.columns:
+        if isinstance(column.type, Boolean):
+            parsers[column.name] = parse_bool
+        elif isinstance(column.type, Integer):
+            parsers[column.name] = int
+        elif isinstance(column.type, Float):
+            parsers[column.name] = float
+        elif isinstance(column.type, DateTime):
+            parsers[column.name] = parse_datetime
+        elif isinstance(column.type, JSON):
+            parsers[column.name] = parse_json
+        else:
+            parsers[column.name] = str
+    return parsers
+
+
+def coerce_rows(table, rows):
+    """Convert file rows to column values.
+
+    Empty values are left out, so the column's default applies. Unknown
+    columns are an error.
+    """
+    parsers = column_parsers(table)
+    for row in rows:
+        unknown = set(row) - set(parsers)
+        if unknown:
+            raise ValueError(f"Unknown {table.name} columns: {', '.join(sorted(unknown))}")
+        yield {name: parsers[name](value) for name, value in row.items()
+               if value is not None and value != ''}
+
+
+@contextmanager
+def relaxed_sync(connection):
+    """Skip fsyncs on a SQLite connection for the duration of an import.
+
+    A crash mid-import can lose the most recent chunks but cannot corrupt
+    the file in WAL mode. The connection's previous setting is restored
+    before it goes back to the pool.
+    """
+    if connection.dialect.name != 'sqlite':
+        yield
+        return
+    previous = connection.exec_driver_sql('PRAGMA synchronous').scalar()
+    connection.exec_driver_sql('PRAGMA synchronous=OFF')
+    # Pragmas autobegin a transaction; each chunk starts its own
+    connection.commit()
+    try:
+        yield
+    finally:
+        connection.rollback()
+        connection.exec_driver_sql(f'PRAGMA synchronous={int(previous)}')
+        connection.commit()
+
+
+def import_rows(table, rows, chunk_size=CHUNK_SIZE, report=True):
+    """Insert ``rows`` into ``table`` with one executemany and transaction per chunk.
+
+    Rows are dicts of column values and may be any iterable, so files
+    larger than memory stream through. Returns the number of rows written.
+    """
+    started = time.perf_counter()
+    count = 0
+    with db.engine.connect() as connection, relaxed_sync(connection):
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                count += _insert_chunk(connection, table, chunk)
+                chunk = []
+        if chunk:
+            count += _insert_chunk(connection, table, chunk)
+
+    elapsed = time.perf_counter() - started
+    if report:
+        print(f"Imported {count} rows into {table.name} in {elapsed:.2f}s "
+              f"({count / elapsed if elapsed else 0:.0f} rows/s)")
+    return count
+
+
+def _insert_chunk(connection, table, chunk):
+    # One executemany needs the same columns in every row
+    groups = {}
+    for row in chunk:
+        groups.setdefault(tuple(sorted(row)), []).append(row)
+    with connection.begin():
+        for group in groups.values():
+            connection.execute(table.insert(), group)
+    return len(chunk)
+
+
+def clear_tables():
+    """Delete every story, user and their dependent rows in one transaction"""
+    with db.engine.begin() as connection:
+        for table in [MaterializedRecommendation.__table__,
+                      UserInteraction.__table__, UserPreference.__table__,
+                      Story.__table__, User.__table__]:
+            connection.execute(table.delete())
+
+
+def refresh_users(user_ids):
+    """Mark users whose interactions or preferences were imported as changed"""
+    user_ids = sorted(user_ids)
+    for start in range(0, len(user_ids), QUERY_CHUNK_SIZE):
+        chunk = user_ids[start:start + QUERY_CHUNK_SIZE]
+        materialized.invalidate_users(chunk)
+        touch_users(chunk)
+    db.session.commit()
+
+
+def main(args):
+    # A bare app: importing app.py would start its background threads
+    app = database.create_app()
+
+    with app.app_context():
+        db.create_all()
+        migrations.upgrade()
+        if args.replace:
+            clear_tables()
+
+        changed_users = set()
+        for kind in TABLES:
+            path = getattr(args, kind)
+            if not path:
+                continue
+            if not os.path.exists(path):
+                print(f"File not found: {path}")
+                return 1
+
+            table = TABLES[kind]
+            rows = coerce_rows(table, read_rows(path))
+            if kind in ('preferences', 'interactions'):
+                rows = _collect_users(rows, changed_users)
+            import_rows(table, rows, args.chunk_size)
+
+        # Imported feedback and preferences change existing users' rankings
+        if changed_users and not args.replace:
+            refresh_users(changed_users)
+    return 0
+
+
+def _collect_users(rows, user_ids):
+    for row in rows:
+        user_ids.add(row['user_id'])
+        yield row
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Import users, stories, preferences and interactions '
+                    'from CSV or NDJSON files')
+    for kind in TABLES:
+        parser.add_argument(f'--{kind}', help=f'file of {kind} rows')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help='rows written per transaction')
+    parser.add_argument('--replace', action='store_true',
+                        help='delete existing users, stories and their rows first')
+    args = parser.parse_args()
+    sys.exit(main(args))
@@ -0,0 +1,64 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+
+class RecommendationCache:
+    """Bounded LRU cache with a time-to-live for per-user results.
+
+    Keys are tuples whose first element is the user id, which lets every
+    entry for a user be dropped at once when their state changes.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._user_keys = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value for key, or None if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._user_keys[key[0]].add(key)
+
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id):
+        """Drop every cached entry belonging to a user"""
+        with self._lock:
+            for key in list(self._user_keys.get(user_id, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._user_keys.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        del self._entries[key]
+        user_keys = self._user_keys[key[0]]
+        user_keys.discard(key)
+        if not user_keys:
+            del self._user_keys[key[0]]
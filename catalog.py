@@ -0,0 +1,482 @@
+import hashlib
+import json
+import numpy as np
+from sqlalchemy import case, func
+from database import read_session
+from models import Story, UserInteraction
+
+PLACEHOLDER_COVER = '/static/placeholder.jpg'
+
+# Number of stories in each page section
+SECTION_SIZE = 5
+
+# Served when the stories table is empty so a fresh install still has
+# something to show
+SAMPLE_STORIES = [
+    {
+        'id': 1,
+        'title': 'The Silent Patient',
+        'author': 'Alex Michaelides',
+        'category': 'Mystery',
+        'match_score': 98
+    },
+    {
+        'id': 2,
+        'title': 'Atomic Habits',
+        'author': 'James Clear',
+        'category': 'Self-Help',
+        'match_score': 95
+    },
+    {
+        'id': 3,
+        'title': 'Project Hail Mary',
+        'author': 'Andy Weir',
+        'category': 'Fiction',
+        'match_score': 94
+    },
+    {
+        'id': 4,
+        'title': 'The Midnight Library',
+        'author': 'Matt Haig',
+        'category': 'Fiction',
+        'match_score': 92
+    },
+    {
+        'id': 5,
+        'title': 'Where the Crawdads Sing',
+        'author': 'Delia Owens',
+        'category': 'Fiction',
+        'match_score': 90
+    },
+    {
+        'id': 6,
+        'title': 'Educated',
+        'author': 'Tara Westover',
+        'category': 'History',
+        'match_score': 88
+    },
+    {
+        'id': 7,
+        'title': 'The Alchemist',
+        'author': 'Paulo Coelho',
+        'category': 'Fiction',
+        'match_score': 85
+    },
+    {
+        'id': 8,
+        'title': 'The Four Agreements',
+        'author': 'Don Miguel Ruiz',
+        'category': 'Self-Help',
+        'match_score': 82
+    },
+    {
+        'id': 9,
+        'title': 'The Power of Now',
+        'author': 'Eckhart Tolle',
+        'category': 'Self-Help',
+        'match_score': 80
+    },
+    {
+        'id': 10,
+        'title': 'The 7 Habits of Highly Effective People',
+        'author': 'Stephen R. Covey',
+        'category': 'Business',
+        'match_score': 78
+    },
+    {
+        'id': 11,
+        'title': 'The Art of War',
+        'author': 'Sun Tzu',
+        'category': 'Business',
+        'match_score': 75
+    },
+    {
+        'id': 12,
+        'title': 'The Lean Startup',
+        'author': 'Eric Ries',
+        'category': 'Business',
+        'match_score': 72
+    },
+    {
+        'id': 13,
+        'title': 'The Psychology of Money',
+        'author': 'Morgan Housel',
+        'category': 'Business',
+        'match_score': 70
+    },
+    {
+        'id': 14,
+        'title': 'The Subtle Art of Not Giving a F*ck',
+        'author': 'Mark Manson',
+        'category': 'Self-Help',
+        'match_score': 68
+    },
+    {
+        'id': 15,
+        'title': 'The 48 Laws of Power',
+        'author': 'Robert Greene',
+        'category': 'Business',
+        'match_score': 65
+    },
+    {
+        'id': 16,
+        'title': 'The 5 Love Languages',
+        'author': 'Gary Chapman',
+        'category': 'Romance',
+        'match_score': 62
+    },
+    {
+        'id': 17,
+        'title': 'The Road Less Traveled',
+        'author': 'M. Scott Peck',
+        'category': 'Self-Help',
+        'match_score': 60
+    },
+    {
+        'id': 18,
+        'title': 'The Four Winds',
+        'author': 'Kristin Hannah',
+        'category': 'Fiction',
+        'match_score': 58
+    },
+    {
+        'id': 19,
+        'title': 'Think Like a Monk',
+        'author': 'Jay Shetty',
+        'category': 'Self-Help',
+        'match_score': 96
+    },
+    {
+        'id': 20,
+        'title': 'The 5 AM Club',
+        'author': 'Robin Sharma',
+        'category': 'Self-Help',
+        'match_score': 93
+    },
+    {
+        'id': 21,
+        'title': 'The Miracle Morning',
+        'author': 'Hal Elrod',
+        'category': 'Self-Help',
+        'match_score': 91
+    },
+    {
+        'id': 22,
+        'title': 'The Compound Effect',
+        'author': 'Darren Hardy',
+        'category': 'Self-Help',
+        'match_score': 89
+    },
+    {
+        'id': 23,
+        'title': 'The One Thing',
+        'author': 'Gary Keller',
+        'category': 'Self-Help',
+        'match_score': 87
+    },
+    {
+        'id': 24,
+        'title': 'Deep Work',
+        'author': 'Cal Newport',
+        'category': 'Self-Help',
+        'match_score': 85
+    }
+]
+
+
+def story_card(row, score):
+    """Serialize a story's display fields with its 0-1 score as a 0-100 match score"""
+    return {
+        'id': row.id,
+        'title': row.title,
+        'author': row.author,
+        'category': row.category,
+        'match_score': round(100 * score),
+        'cover_image': row.cover_image or PLACEHOLDER_COVER
+    }
+
+
+def load_story_cards(ranked):
+    """Story cards for ``(story_id, score)`` pairs with one query, keeping their order"""
+    if not ranked:
+        return []
+
+    rows = read_session.query(
+        Story.id, Story.title, Story.author, Story.category, Story.cover_image
+    ).filter(Story.id.in_([sid for sid, _ in ranked])).all()
+    rows = {row.id: row for row in rows}
+    return [story_card(rows[sid], score) for sid, score in ranked if sid in rows]
+
+
+def iter_stories(category=None, batch_size=1000):
+    """Yield every story's exported fields in id order.
+
+    Rows come from a server-side cursor ``batch_size`` at a time, so memory
+    use does not grow with the size of the catalog.
+    """
+    query = read_session.query(
+        Story.id, Story.title, Story.author, Story.category,
+        Story.description, Story.cover_image, Story.created_at)
+    if category and category != 'All':
+        query = query.filter(Story.category == category)
+
+    for row in query.order_by(Story.id).yield_per(batch_size):
+        yield {
+            'id': row.id,
+            'title': row.title,
+            'author': row.author,
+            'category': row.category,
+            'description': row.description,
+            'cover_image': row.cover_image or PLACEHOLDER_COVER,
+            'created_at': row.created_at.isoformat() if row.created_at else None
+        }
+
+
+def stories_version(category=None):
+    """Number of stories an export would include and when they last changed"""
+    query = read_session.query(
+        func.count(Story.id), func.max(Story.created_at),
+        func.max(Story.updated_at))
+    if category and category != 'All':
+        query = query.filter(Story.category == category)
+    count, created, updated = query.one()
+    changes = [time for time in (created, updated) if time is not None]
+    return count, max(changes) if changes else None
+
+
+def section_items(sections):
+    """Flatten page sections into stories tagged with their section name"""
+    for section, stories in sections.items():
+        for story in stories:
+            yield dict(story, section=section)
+
+
+def personalized_sections(stories, fallback):
+    """Split one user's ranked stories into consecutive page sections.
+
+    Sections the user's stories leave short, as in small categories, are
+    topped up with the not yet shown stories of ``fallback``, the
+    catalog's sections for the same category, so no section is empty.
+    """
+    shown = {story['id'] for story in stories[:3 * SECTION_SIZE]}
+    sections = {}
+    for position, name in enumerate(['highly_recommended',
+                                     'because_you_listened',
+                                     'new_discoveries']):
+        section = stories[position * SECTION_SIZE:(position + 1) * SECTION_SIZE]
+        if len(section) < SECTION_SIZE:
+            extra = [story for story in fallback[name]
+                     if story['id'] not in shown][:SECTION_SIZE - len(section)]
+            shown.update(story['id'] for story in extra)
+            section = section + extra
+        sections[name] = section or fallback[name]
+    return sections
+
+
+class StoryColumns:
+    """Compact, columnar description of the stories in a model snapshot.
+
+    Each attribute is a NumPy array with one entry per model row, so
+    scoring can work on whole columns instead of ORM instances. Text
+    fields that ranking does not need are not kept at all; see
+    StoryRecord for the display fields of the final results.
+    """
+
+    __slots__ = ('ids', 'category_codes', 'categories', 'author_codes',
+                 'authors', 'author_index', 'created_at')
+
+    def __init__(self, ids, category_codes, categories, author_codes,
+                 authors, created_at):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.category_codes = np.asarray(category_codes, dtype=np.int32)
+        self.categories = list(categories)
+        self.author_codes = np.asarray(author_codes, dtype=np.int32)
+        self.authors = list(authors)
+        self.author_index = {author: code for code,
+                             author in enumerate(self.authors)}
+        self.created_at = np.asarray(created_at, dtype='datetime64[us]')
+
+    @classmethod
+    def from_values(cls, ids, categories, authors, created_at):
+        """Build the columns from one category, author and created_at value per story"""
+        category_names, category_codes = np.unique(
+            np.asarray(categories, dtype=object).astype(str), return_inverse=True)
+        author_names, author_codes = np.unique(
+            np.asarray(authors, dtype=object).astype(str), return_inverse=True)
+        return cls(ids, category_codes, category_names.tolist(),
+                   author_codes, author_names.tolist(),
+                   np.array(created_at, dtype='datetime64[us]'))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def category_values(self):
+        return np.asarray(self.categories, dtype=object)[self.category_codes]
+
+    def author_values(self):
+        return np.asarray(self.authors, dtype=object)[self.author_codes]
+
+    def with_changes(self, rows, stories, new_stories):
+        """Return new columns with ``rows`` replaced by ``stories`` and ``new_stories`` appended"""
+        categories = self.category_values()
+        authors = self.author_values()
+        created_at = self.created_at.copy()
+        for row, story in zip(rows, stories):
+            categories[row] = story.category
+            authors[row] = story.author
+            created_at[row] = story.created_at
+
+        return StoryColumns.from_values(
+            np.concatenate([self.ids, [s.id for s in new_stories]]),
+            np.concatenate([categories, [s.category for s in new_stories]]),
+            np.concatenate([authors, [s.author for s in new_stories]]),
+            np.concatenate([created_at, np.array(
+                [s.created_at for s in new_stories], dtype='datetime64[us]')]))
+
+
+class StoryRecord:
+    """Display fields of one story, loaded only for the stories being returned"""
+
+    __slots__ = ('id', 'title', 'author', 'category', 'description')
+
+    def __init__(self, id, title, author, category, description):
+        self.id = id
+        self.title = title
+        self.author = author
+        self.category = category
+        self.description = description
+
+    @classmethod
+    def load(cls, story_ids):
+        """Load records for ``story_ids`` with one query, keeping their order"""
+        if not len(story_ids):
+            return []
+
+        story_ids = [int(sid) for sid in story_ids]
+        rows = read_session.query(
+            Story.id, Story.title, Story.author, Story.category,
+            Story.description
+        ).filter(Story.id.in_(story_ids)).all()
+        records = {row.id: cls(*row) for row in rows}
+        return [records[sid] for sid in story_ids if sid in records]
+
+
+class StoryCatalog:
+    """Read-only, precomputed view of the story catalog used to build page sections.
+
+    Stories are ranked once, when the catalog is built, and grouped into
+    per-category lists that keep the same order. Building the sections for
+    a request then only walks the first few entries of those lists.
+    """
+
+    def __init__(self, stories, last_modified=None):
+        # Highest score first; ties keep their original order
+        self.ranked = sorted(stories, key=lambda s: -s['match_score'])
+        # HTTP cache validators. Both derive from the data the catalog was
+        # built from, so every worker process that built it from the same
+        # rows agrees on them, and a rebuild without changes keeps them.
+        self.version = hashlib.sha1(
+            json.dumps(self.ranked, sort_keys=True).encode()).hexdigest()[:20]
+        self.last_modified = last_modified
+        self.by_category = {}
+        for story in self.ranked:
+            self.by_category.setdefault(story['category'], []).append(story)
+
+    @classmethod
+    def from_database(cls):
+        """Build the catalog from the stories table.
+
+        A story's score is the share of positive interactions it received,
+        smoothed so that stories without interactions score 50.
+        """
+        positive = func.sum(case((UserInteraction.is_positive, 1), else_=0))
+        total = func.count(UserInteraction.id)
+        rows = read_session.query(
+            Story.id, Story.title, Story.author, Story.category,
+            Story.cover_image, positive, total
+        ).outerjoin(UserInteraction, UserInteraction.story_id == Story.id) \
+            .group_by(Story.id).order_by(Story.id).all()
+
+        if not rows:
+            return cls.sample()
+
+        # Latest change to the stories or the feedback behind their scores
+        _, stories_changed = stories_version()
+        feedback_changed = read_session.query(
+            func.max(UserInteraction.created_at)).scalar()
+        changes = [time for time in (stories_changed, feedback_changed)
+                   if time is not None]
+
+        return cls([{
+            'id': row.id,
+            'title': row.title,
+            'author': row.author,
+            'category': row.category,
+            'match_score': round(100 * ((row[5] or 0) + 1) / (row[6] + 2)),
+            'cover_image': row.cover_image or PLACEHOLDER_COVER
+        } for row in rows], max(changes) if changes else None)
+
+    @classmethod
+    def sample(cls):
+        return cls([dict(story, cover_image=PLACEHOLDER_COVER)
+                    for story in SAMPLE_STORIES])
+
+    def __len__(self):
+        return len(self.ranked)
+
+    def sections(self, category='All'):
+        """Build the highly recommended, because you listened and new discoveries sections"""
+        ranked = self.ranked
+        if not ranked:
+            return {'highly_recommended': [], 'because_you_listened': [],
+                    'new_discoveries': []}
+
+        if category == 'All':
+            # The highest rated story leads its own category list, so the
+            # "Because You Listened" section is that list without it
+            same_category = self.by_category[ranked[0]['category']]
+            highly_recommended = same_category[:SECTION_SIZE]
+            similar_books = same_category[1:SECTION_SIZE + 1]
+
+            shown = {s['id'] for s in highly_recommended}
+            shown.update(s['id'] for s in similar_books)
+            new_discoveries = self._first(
+                SECTION_SIZE, lambda s: s['id'] not in shown)
+        else:
+            category_stories = self.by_category.get(category, [])
+            if len(category_stories) >= SECTION_SIZE:
+                highly_recommended = category_stories[:SECTION_SIZE]
+                similar_books = category_stories[1:SECTION_SIZE + 1]
+                new_discoveries = category_stories[
+                    SECTION_SIZE + 1:2 * SECTION_SIZE + 1]
+            else:
+                # Not enough books in this category, fill with the highest
+                # rated books from other categories
+                similar_books = category_stories[1:]
+                other_books = self._first(
+                    2 * SECTION_SIZE,
+                    lambda s: s['category'] != category)
+
+                highly_recommended = category_stories + \
+                    other_books[:SECTION_SIZE - len(category_stories)]
+                similar_books = similar_books + \
+                    other_books[:SECTION_SIZE - len(similar_books)]
+                new_discoveries = other_books[
+                    len(similar_books):len(similar_books) + SECTION_SIZE]
+
+        # Ensure we always have books in each section
+        return {
+            'highly_recommended': highly_recommended or ranked[:SECTION_SIZE],
+            'because_you_listened': similar_books or ranked[1:SECTION_SIZE + 1],
+            'new_discoveries': new_discoveries or ranked[SECTION_SIZE + 1:2 * SECTION_SIZE + 1]
+        }
+
+    def _first(self, limit, predicate):
+        """First ``limit`` ranked stories matching predicate"""
+        matches = []
+        for story in self.ranked:
+            if len(matches) == limit:
+                break
+            if predicate(story):
+                matches.append(story)
+        return matches
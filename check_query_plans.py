@@ -0,0 +1,139 @@
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime
+from flask import Flask
+from sqlalchemy import event
+from extensions import db
+from models import Story, User
+from ai_model import (StoryRecommender, load_preference_weights,
+                      load_story_popularity, save_preference_weights)
+from catalog import load_story_cards
+import materialized
+import migrations
+
+# A plan step that reads a whole table rather than one of its indexes.
+# Scans of subqueries and constant rows are matched too and filtered out
+# by table name.
+FULL_SCAN = re.compile(r'^SCAN (\S+)$')
+# SQLite building a temporary index because no usable one exists
+AUTOMATIC_INDEX = re.compile(r'AUTOMATIC')
+
+
+def exercise(recommender, user_ids, story_ids):
+    """Run the recommender's per-request and feedback code paths"""
+    user_id = user_ids[0]
+    categories = recommender.categories()
+
+    recommender.update_model(incremental=True)
+    load_story_popularity()
+    for category in ['All'] + categories[:1]:
+        ranked = recommender.get_top_scores(user_id, category, materialized.TOP_N)
+    recommender.get_ranked_recommendations(user_id, 'All', 0, 6)
+    recommender.rank_batch(user_ids, 'All', materialized.TOP_N)
+    load_story_cards(ranked)
+
+    materialized.load_stories(user_id, 'All')
+    materialized.changed_since(user_ids, datetime.utcnow())
+
+    weights = load_preference_weights(user_id)
+    save_preference_weights(user_id, weights)
+    materialized.invalidate_users([user_id])
+    db.session.commit()
+
+    recommender.process_feedback_batch([
+        (user_id, story_ids[0], True),
+        (user_ids[-1], story_ids[-1], False),
+    ])
+
+
+def capture_statements(engine, run):
+    """Run ``run()`` and return the distinct statements it sent to ``engine``"""
+    statements = {}
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+            statements.setdefault(
+                statement, parameters[0] if executemany else parameters)
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        run()
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    return statements
+
+
+def is_full_scan(detail):
+    match = FULL_SCAN.match(detail)
+    if match and match.group(1) in db.metadata.tables:
+        return True
+    return bool(AUTOMATIC_INDEX.search(detail))
+
+
+def check_plans(engine, statements):
+    """Print the query plan of every statement and return the number of full scans"""
+    failures = 0
+    with engine.connect() as connection:
+        for statement, parameters in statements.items():
+            plan = connection.exec_driver_sql(
+                f'EXPLAIN QUERY PLAN {statement}', parameters).all()
+            scans = [row[-1] for row in plan if is_full_scan(row[-1])]
+            failures += len(scans)
+
+            print(('FAIL ' if scans else 'ok   ') + ' '.join(statement.split())[:120])
+            for row in plan:
+                print(f"       {row[-1]}")
+    return failures
+
+
+def main(database, users):
+    if not os.path.exists(database):
+        print(f"Database not found: {database}")
+        return 2
+
+    # Work on a copy, since the feedback path writes
+    with tempfile.TemporaryDirectory() as directory:
+        copy = os.path.join(directory, 'plans.db')
+        with sqlite3.connect(database) as source, sqlite3.connect(copy) as target:
+            source.backup(target)
+
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{copy}'
+        app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        db.init_app(app)
+
+        with app.app_context():
+            db.create_all()
+            migrations.upgrade()
+
+            user_ids = [uid for (uid,) in
+                        db.session.query(User.id).order_by(User.id).limit(users)]
+            story_ids = [sid for (sid,) in
+                         db.session.query(Story.id).order_by(Story.id).limit(2)]
+            if not user_ids or not story_ids:
+                print('The database needs users and stories; run sample_data.py first')
+                return 2
+
+            recommender = StoryRecommender()
+            statements = capture_statements(
+                db.engine, lambda: exercise(recommender, user_ids, story_ids))
+            failures = check_plans(db.engine, statements)
+            db.engine.dispose()
+
+    print(f"{len(statements)} statements checked, {failures} full table scans")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Fail when a recommender query plans a full table scan')
+    parser.add_argument('--database', default=os.path.join('instance', 'storymorph.db'),
+                        help='SQLite database to check (it is copied, not modified)')
+    parser.add_argument('--users', type=int, default=20,
+                        help='users scored in the batch path')
+    args = parser.parse_args()
+    sys.exit(main(args.database, args.users))
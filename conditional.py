@@ -0,0 +1,44 @@
+import hashlib
+from flask import Response, request
+
+# Clients may store responses but must revalidate them on every use
+CACHE_CONTROL = 'no-cache'
+
+
+def make_etag(*parts):
+    """An entity tag derived from the versions a response depends on"""
+    key = '|'.join('' if part is None else str(part) for part in parts)
+    return hashlib.sha1(key.encode()).hexdigest()[:20]
+
+
+def not_modified(etag, last_modified=None):
+    """A 304 response when the client's copy is current, otherwise None.
+
+    Call this before doing any work for the response, with validators
+    computed from version numbers alone. If-None-Match takes precedence
+    over If-Modified-Since, as in RFC 9110. Only GET and HEAD requests are
+    answered conditionally.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return None
+
+    if request.if_none_match:
+        matched = request.if_none_match.contains_weak(etag)
+    elif last_modified is not None and request.if_modified_since:
+        matched = last_modified.replace(microsecond=0) <= \
+            request.if_modified_since.replace(tzinfo=None)
+    else:
+        matched = False
+
+    if not matched:
+        return None
+    return add_validators(Response(status=304), etag, last_modified)
+
+
+def add_validators(response, etag, last_modified=None):
+    """Attach the ETag, Last-Modified and Cache-Control headers to ``response``"""
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = CACHE_CONTROL
+    return response
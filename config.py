@@ -11,3 +11,66 @@ class Config:
         'DATABASE_URL') or 'sqlite:///storymorph.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     STATIC_FOLDER = 'static'
+    # Share of out-of-vocabulary tokens in incrementally added stories
+    # that triggers a full TF-IDF refit
+    VOCABULARY_DRIFT_THRESHOLD = float(
+        os.environ.get('VOCABULARY_DRIFT_THRESHOLD') or 0.1)
+    # Seconds between background rebuilds of the recommendation model
+    MODEL_REFRESH_INTERVAL = int(
+        os.environ.get('MODEL_REFRESH_INTERVAL') or 3600)
+    # Directory holding the persisted, memory-mapped model artifacts
+    MODEL_ARTIFACT_DIR = os.environ.get(
+        'MODEL_ARTIFACT_DIR') or 'model_artifacts'
+    # Per-user ranked recommendation cache. Entries are dropped when the
+    # user's feedback or preferences change in this process; the TTL bounds
+    # how long other worker processes can serve an older list.
+    RECOMMENDATION_CACHE_SIZE = int(
+        os.environ.get('RECOMMENDATION_CACHE_SIZE') or 1024)
+    RECOMMENDATION_CACHE_TTL = int(
+        os.environ.get('RECOMMENDATION_CACHE_TTL') or 300)
+    # Categories with more stories than this are not scored in full per
+    # request; about CANDIDATE_POOL_SIZE likely stories are picked from
+    # popularity, preferences and liked stories and only those are scored
+    EXACT_SCORING_LIMIT = int(os.environ.get('EXACT_SCORING_LIMIT') or 5000)
+    CANDIDATE_POOL_SIZE = int(os.environ.get('CANDIDATE_POOL_SIZE') or 500)
+    # Seconds between background rebuilds of the candidate index, which
+    # orders stories by popularity. 0 rebuilds it only with the model.
+    CANDIDATE_INDEX_REFRESH_INTERVAL = int(
+        os.environ.get('CANDIDATE_INDEX_REFRESH_INTERVAL') or 300)
+    # Append-only file queueing feedback until it is applied to the database
+    FEEDBACK_JOURNAL_PATH = os.environ.get(
+        'FEEDBACK_JOURNAL_PATH') or 'feedback_journal.ndjson'
+    # Seconds between batches of queued feedback being applied
+    FEEDBACK_FLUSH_INTERVAL = float(
+        os.environ.get('FEEDBACK_FLUSH_INTERVAL') or 1.0)
+    # Connection pool of each database engine
+    DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE') or 5)
+    DATABASE_MAX_OVERFLOW = int(os.environ.get('DATABASE_MAX_OVERFLOW') or 10)
+    DATABASE_POOL_TIMEOUT = int(os.environ.get('DATABASE_POOL_TIMEOUT') or 30)
+    # SQLite page cache per connection in KiB, and bytes of the database
+    # file read through memory-mapped I/O
+    SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB') or 65536)
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE') or 268435456)
+    # Processes that score recommendation batches outside the serving
+    # process. 0 scores them in the request thread, which suits sync
+    # workers. Single-user requests are always scored in the request thread.
+    SCORING_POOL_SIZE = int(os.environ.get('SCORING_POOL_SIZE') or 0)
+    # Threads running Flask requests under the ASGI server (asgi.py)
+    ASGI_THREADS = int(os.environ.get('ASGI_THREADS') or 32)
+    # Requests slower than this many milliseconds have their sampled
+    # stacks written to PROFILE_DIR as folded flame graph input. 0 turns
+    # the sampling profiler off.
+    SLOW_REQUEST_PROFILE_MS = int(os.environ.get('SLOW_REQUEST_PROFILE_MS') or 0)
+    PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS') or 5)
+    PROFILE_DIR = os.environ.get('PROFILE_DIR') or 'profiles'
+    # Most SQL statements, and milliseconds of SQL, one request to an
+    # endpoint may use, as comma-separated endpoint=limit pairs. Requests
+    # over budget log a warning, or fail when SQL_BUDGET_STRICT is set
+    # or the app is in testing mode.
+    SQL_QUERY_BUDGETS = os.environ.get('SQL_QUERY_BUDGETS') or (
+        'get_recommendations=8,get_recommendations_page=8,'
+        'get_recommendations_batch=10,get_user=4,'
+        'update_user_preferences=8,handle_feedback=2')
+    SQL_TIME_BUDGETS_MS = os.environ.get('SQL_TIME_BUDGETS_MS') or ''
+    SQL_BUDGET_STRICT = (os.environ.get('SQL_BUDGET_STRICT') or '').lower() in (
+        '1', 'true', 'yes')
@@ -0,0 +1,124 @@
+from flask import Flask
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session, scoped_session, sessionmaker
+from flask.globals import app_ctx
+from extensions import db
+from config import Config
+
+# Bind key of the read-only engine that serves recommendation reads
+READ_ONLY_BIND = 'read_only'
+
+
+def database_url():
+    """The configured database URL, accepting Heroku-style postgres:// URLs"""
+    url = Config.SQLALCHEMY_DATABASE_URI
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def is_sqlite_file(url):
+    """Whether ``url`` names an SQLite database file rather than an in-memory one"""
+    url = make_url(url)
+    return url.get_backend_name() == 'sqlite' and \
+        url.database not in (None, '', ':memory:') and \
+        url.query.get('mode') != 'memory'
+
+
+def read_only_url(url):
+    """A URL opening the same SQLite file read-only, or None for other databases"""
+    if not is_sqlite_file(url):
+        return None
+    url = make_url(url)
+    database = url.database
+    if url.query.get('uri'):
+        database = database[len('file:'):].split('?')[0]
+    return url.set(database=f'file:{database}',
+                   query={'mode': 'ro', 'uri': 'true'}).render_as_string(
+                       hide_password=False)
+
+
+def engine_options(url):
+    """Pool settings for an engine on ``url``.
+
+    In-memory SQLite databases live in a single connection that the
+    engine keeps in a StaticPool or SingletonThreadPool, which take no
+    size or timeout, so only file and server databases get them.
+    """
+    options = {'pool_pre_ping': True}
+    if make_url(url).get_backend_name() != 'sqlite' or is_sqlite_file(url):
+        options.update(
+            pool_size=Config.DATABASE_POOL_SIZE,
+            max_overflow=Config.DATABASE_MAX_OVERFLOW,
+            pool_timeout=Config.DATABASE_POOL_TIMEOUT)
+    return options
+
+
+def set_sqlite_pragmas(dbapi_connection, read_only=False):
+    """Tune a new SQLite connection.
+
+    WAL lets readers run alongside the single writer instead of waiting on
+    the rollback journal lock, and synchronous=NORMAL only syncs at
+    checkpoints, which is safe in WAL mode. The journal mode is stored in
+    the database file, so read-only connections inherit it.
+    """
+    cursor = dbapi_connection.cursor()
+    if not read_only:
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute(f'PRAGMA mmap_size={int(Config.SQLITE_MMAP_SIZE)}')
+    # Negative values are in KiB rather than pages
+    cursor.execute(f'PRAGMA cache_size={-int(Config.SQLITE_CACHE_SIZE_KB)}')
+    cursor.close()
+
+
+class ReadOnlySession(Session):
+    """Session that runs on the read-only engine when one is configured"""
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        return db.engines.get(READ_ONLY_BIND) or db.engine
+
+
+# Session for reads that never write, such as scoring and page rendering.
+# Like db.session, it is scoped to the application context.
+read_session = scoped_session(
+    sessionmaker(class_=ReadOnlySession),
+    scopefunc=lambda: id(app_ctx._get_current_object()))
+
+
+def init_app(app, url=None):
+    """Configure the app's database and register it with ``db``.
+
+    The database URL comes from Config unless ``url`` is given.
+    """
+    url = url or database_url()
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = Config.SQLALCHEMY_TRACK_MODIFICATIONS
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(url)
+    read_url = read_only_url(url)
+    if read_url:
+        app.config['SQLALCHEMY_BINDS'] = {
+            READ_ONLY_BIND: dict(engine_options(read_url), url=read_url)}
+
+    db.init_app(app)
+    app.teardown_appcontext(lambda exc: read_session.remove())
+
+    with app.app_context():
+        for bind_key, engine in db.engines.items():
+            if engine.dialect.name == 'sqlite':
+                read_only = bind_key == READ_ONLY_BIND
+                event.listen(engine, 'connect',
+                             lambda connection, record, read_only=read_only:
+                             set_sqlite_pragmas(connection, read_only))
+
+
+def create_app(url=None):
+    """An app on the configured database, for command line tools.
+
+    Unlike app.py it starts no model refresh thread and no feedback
+    consumer, and registers no routes.
+    """
+    app = Flask(__name__)
+    init_app(app, url)
+    return app
@@ -0,0 +1,237 @@
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from extensions import db
+
+# After a batch fails its events are retried one at a time. When this many
+# fail in a row from the start, the database is taken to be at fault
+# rather than the events, and the segment is retried on a later pass.
+FAILURES_BEFORE_RETRY = 3
+
+# Passes a segment is retried for before its events are dead-lettered
+MAX_SEGMENT_ATTEMPTS = 5
+
+
+class FeedbackJournal:
+    """Durable, append-only queue of feedback events waiting to be applied.
+
+    Request handlers append one JSON line per event and return without
+    touching the database. A consumer claims everything appended so far by
+    renaming the journal to a new segment file and applies the segment as
+    one batch. Appends and renames hold an exclusive lock on a sidecar lock
+    file, so the journal can be shared by several worker processes.
+
+    Events that cannot be applied are moved to a dead-letter file next to
+    the journal, one JSON line each with an added ``error`` field, so they
+    never hold back the events behind them. Appending those lines back to
+    the journal queues them again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = f"{path}.lock"
+        self.dead_letter_path = f"{path}.dead"
+        # Failed passes over each segment, in this process
+        self._attempts = {}
+
+    @contextmanager
+    def _locked(self):
+        with open(self.lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def append(self, user_id, story_id, is_positive, section=None):
+        """Durably record one feedback event"""
+        line = json.dumps({
+            'user_id': user_id,
+            'story_id': story_id,
+            'is_positive': is_positive,
+            'section': section,
+            'at': datetime.utcnow().isoformat()
+        }) + '\n'
+        with self._locked():
+            with open(self.path, 'a') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def rotate(self):
+        """Move the events appended so far into a new segment file.
+
+        Returns the segment path, or None when nothing is waiting.
+        Segment names sort in the order they were created.
+        """
+        with self._locked():
+            if not os.path.exists(self.path) or not os.path.getsize(self.path):
+                return None
+            segment = f"{self.path}.{time.time_ns():020d}-{uuid.uuid4().hex[:8]}.segment"
+            os.replace(self.path, segment)
+            return segment
+
+    def segments(self):
+        """Segments waiting to be applied, oldest first.
+
+        Includes segments left behind by a consumer that stopped before
+        finishing them.
+        """
+        directory = os.path.dirname(self.path) or '.'
+        prefix = os.path.basename(self.path) + '.'
+        return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                      if name.startswith(prefix) and name.endswith('.segment'))
+
+    def consume(self, segment, apply):
+        """Pass the events of one segment to ``apply`` and delete it.
+
+        The segment is locked while it is applied so that consumers in
+        other processes skip it. A segment is only deleted after ``apply``
+        returns, so events are applied at least once: if the process dies
+        in between, the segment is applied again on the next pass. Events
+        that fail on their own are dead-lettered. When the whole segment
+        keeps failing, the error is raised and the segment stays for the
+        next pass, up to MAX_SEGMENT_ATTEMPTS passes.
+        Returns the number of events applied.
+        """
+        try:
+            f = open(segment)
+        except FileNotFoundError:
+            return 0
+
+        with f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0
+            if os.fstat(f.fileno()).st_nlink == 0:
+                # Applied and deleted by another consumer while we waited
+                return 0
+
+            events = []
+            for line in f:
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    # A write cut short by a crash; nothing after it is lost
+                    print(f"Skipping malformed feedback event in {segment}")
+
+            failed = []
+            if events:
+                try:
+                    failed = self._apply(events, apply)
+                except Exception as e:
+                    attempts = self._attempts.get(segment, 0) + 1
+                    self._attempts[segment] = attempts
+                    if attempts < MAX_SEGMENT_ATTEMPTS:
+                        raise
+                    failed = [(event, e) for event in events]
+                self._attempts.pop(segment, None)
+
+            if failed:
+                self.dead_letter(failed)
+                print(f"Moved {len(failed)} feedback events from {segment} "
+                      f"to {self.dead_letter_path}")
+            os.remove(segment)
+            return len(events) - len(failed)
+
+    @staticmethod
+    def _apply(events, apply):
+        """Apply events as one batch, or one at a time if the batch fails.
+
+        Returns ``(event, error)`` pairs for the events that failed on
+        their own. Raises when the first events all fail, or every event
+        does.
+        """
+        try:
+            apply(events)
+            return []
+        except Exception:
+            pass
+
+        failed = []
+        for position, event in enumerate(events, 1):
+            try:
+                apply([event])
+            except Exception as e:
+                failed.append((event, e))
+                if len(failed) == position and position in (
+                        FAILURES_BEFORE_RETRY, len(events)):
+                    raise
+        return failed
+
+    def dead_letter(self, failed):
+        """Append ``(event, error)`` pairs to the dead-letter file"""
+        lines = ''.join(json.dumps(dict(event, error=str(error))) + '\n'
+                        for event, error in failed)
+        with self._locked():
+            with open(self.dead_letter_path, 'a') as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def drain(self, apply):
+        """Apply every waiting event, one segment per batch.
+
+        A segment that fails is left for the next pass; the segments after
+        it are still applied.
+        """
+        self.rotate()
+        applied = 0
+        for segment in self.segments():
+            try:
+                applied += self.consume(segment, apply)
+            except Exception as e:
+                print(f"Error applying feedback from {segment}: {str(e)}")
+        return applied
+
+
+class FeedbackConsumer(threading.Thread):
+    """Background thread that applies journaled feedback in batches.
+
+    Every ``interval`` seconds the events queued since the last pass are
+    coalesced and written through ``StoryRecommender.process_feedback_batch``
+    with one commit per batch.
+    """
+
+    def __init__(self, app, journal, recommender, interval):
+        super().__init__(name='feedback-consumer', daemon=True)
+        self.app = app
+        self.journal = journal
+        self.recommender = recommender
+        self.interval = interval
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+
+    def wake(self):
+        self._wake_event.set()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake_event.set()
+
+    def apply(self, events):
+        try:
+            self.recommender.process_feedback_batch(
+                [(event['user_id'], event['story_id'], event['is_positive'])
+                 for event in events])
+        except Exception:
+            # Leave the session usable for the next attempt
+            db.session.rollback()
+            raise
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                with self.app.app_context():
+                    self.journal.drain(self.apply)
+            except Exception as e:
+                print(f"Error applying feedback: {str(e)}")
+
+            self._wake_event.wait(self.interval)
+            self._wake_event.clear()
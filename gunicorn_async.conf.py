@@ -0,0 +1,15 @@
+# Async serving mode:
+#   gunicorn -c gunicorn_async.conf.py asgi:application
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+worker_class = 'uvicorn.workers.UvicornWorker'
+# Each worker holds thousands of idle connections on one event loop, so
+# a few per host are enough; batch scoring runs in their process pools
+workers = int(os.environ.get('WEB_CONCURRENCY') or 2)
+keepalive = 75
+timeout = 60
+graceful_timeout = 30
+
+# Score batches outside the event loop's process unless configured otherwise
+raw_env = [f"SCORING_POOL_SIZE={os.environ.get('SCORING_POOL_SIZE') or 2}"]
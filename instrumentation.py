@@ -0,0 +1,286 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Upper bounds of the histogram buckets, in seconds and in statements
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+@contextmanager
+def stage(name):
+    """Time a block as a named stage of the current request.
+
+    Time spent in the same stage more than once is added up. Outside a
+    request the block runs untimed.
+    """
+    if not has_request_context() or 'stage_timings' not in g:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+
+def record(name, seconds):
+    """Add ``seconds`` to a stage of the current request, if there is one"""
+    if has_request_context() and 'stage_timings' in g:
+        g.stage_timings[name] = g.stage_timings.get(name, 0.0) + seconds
+
+
+def request_stats():
+    """Statements sent to the database by the current request, and their total seconds"""
+    if not has_request_context():
+        return 0, 0.0
+    return g.get('sql_queries', 0), g.get('sql_seconds', 0.0)
+
+
+class QueryCount:
+    """Statements run inside a count_queries() block, and how often each ran"""
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+
+    def add(self, statement, seconds):
+        self.queries += 1
+        self.seconds += seconds
+        self.statements[statement] += 1
+
+
+# count_queries() blocks open in each thread
+_open_counts = threading.local()
+
+
+@contextmanager
+def count_queries():
+    """Count the statements this thread sends to any engine inside the block"""
+    listen_to_engines()
+    count = QueryCount()
+    if not hasattr(_open_counts, 'counts'):
+        _open_counts.counts = []
+    _open_counts.counts.append(count)
+    try:
+        yield count
+    finally:
+        _open_counts.counts.remove(count)
+
+
+def listen_to_engines():
+    """Time the statements of every engine, once per process"""
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('query_started')
+    if not starts:
+        return
+    seconds = time.perf_counter() - starts.pop()
+    for count in getattr(_open_counts, 'counts', ()):
+        count.add(statement, seconds)
+    # Background threads run with an app context but no request
+    if has_request_context() and 'sql_queries' in g:
+        g.sql_queries += 1
+        g.sql_seconds += seconds
+        g.sql_statements[statement] += 1
+
+
+class Histogram:
+    """Cumulative bucket counts, a sum and a count, as Prometheus exposes them"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[position] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        label_text = ','.join(f'{key}="{value}"' for key, value in labels.items())
+        separator = ',' if label_text else ''
+        lines = [f'{name}_bucket{{{label_text}{separator}le="{bound}"}} {count}'
+                 for bound, count in zip(self.buckets, self.counts)]
+        lines.append(f'{name}_bucket{{{label_text}{separator}le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{label_text}}} {self.sum}')
+        lines.append(f'{name}_count{{{label_text}}} {self.count}')
+        return lines
+
+
+class RequestMetrics:
+    """Histograms of request time, stage time and SQL statements per endpoint.
+
+    Counts are kept per process; under several workers each one reports
+    its own.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._durations = defaultdict(lambda: Histogram(DURATION_BUCKETS))
+        self._stages = defaultdict(lambda: Histogram(DURATION_BUCKETS))
+        self._queries = defaultdict(lambda: Histogram(QUERY_BUCKETS))
+        self._query_seconds = defaultdict(lambda: Histogram(DURATION_BUCKETS))
+
+    def observe(self, endpoint, seconds, stages, queries, query_seconds):
+        with self._lock:
+            self._durations[endpoint].observe(seconds)
+            for name, stage_seconds in stages.items():
+                self._stages[(endpoint, name)].observe(stage_seconds)
+            self._queries[endpoint].observe(queries)
+            self._query_seconds[endpoint].observe(query_seconds)
+
+    def render(self):
+        """The histograms in the Prometheus text format"""
+        lines = []
+        with self._lock:
+            for name, description, histograms, label_names in [
+                    ('storymorph_request_seconds', 'Time to produce a response',
+                     self._durations, ('endpoint',)),
+                    ('storymorph_stage_seconds', 'Time spent in each stage of a request',
+                     self._stages, ('endpoint', 'stage')),
+                    ('storymorph_request_sql_queries', 'SQL statements per request',
+                     self._queries, ('endpoint',)),
+                    ('storymorph_request_sql_seconds', 'Time spent in SQL per request',
+                     self._query_seconds, ('endpoint',))]:
+                lines.append(f'# HELP {name} {description}')
+                lines.append(f'# TYPE {name} histogram')
+                for key, histogram in sorted(histograms.items()):
+                    values = key if isinstance(key, tuple) else (key,)
+                    lines += histogram.render(name, dict(zip(label_names, values)))
+        return '\n'.join(lines) + '\n'
+
+
+def fold_stack(frame):
+    """A frame's call stack as one folded line, outermost call first"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class SamplingProfiler(threading.Thread):
+    """Background thread that samples the stacks of threads serving requests.
+
+    Every ``interval`` seconds the stack of each registered thread is
+    recorded in folded form, so a slow request's samples can be written
+    out as input for flamegraph.pl or speedscope. Only threads between
+    ``begin()`` and ``end()`` are sampled.
+    """
+
+    def __init__(self, interval):
+        super().__init__(name='request-profiler', daemon=True)
+        self.interval = interval
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def begin(self):
+        with self._lock:
+            self._samples[threading.get_ident()] = Counter()
+
+    def end(self):
+        """Stop sampling the calling thread and return its folded stack counts"""
+        with self._lock:
+            return self._samples.pop(threading.get_ident(), None)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, samples in self._samples.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        samples[fold_stack(frame)] += 1
+
+
+def write_profile(samples, directory, endpoint):
+    """Write folded stacks to a new file in ``directory`` and return its path"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{endpoint}.folded")
+    with open(path, 'w') as f:
+        for stack, count in samples.most_common():
+            f.write(f'{stack} {count}\n')
+    return path
+
+
+def server_timing(stages, total, queries, query_seconds):
+    """Server-Timing header value for a request's stages"""
+    entries = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in stages.items()]
+    entries.append(f'sql;desc="{queries} queries";dur={query_seconds * 1000:.1f}')
+    entries.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(entries)
+
+
+def init_app(app, metrics, slow_request_ms=0, profile_interval_ms=5,
+             profile_dir='profiles'):
+    """Time every request of ``app`` and record it in ``metrics``.
+
+    Responses carry a Server-Timing header with the request's stages and
+    SQL statements. When ``slow_request_ms`` is set, request threads are
+    sampled and the stacks of requests slower than that are written to
+    ``profile_dir``.
+    """
+    listen_to_engines()
+
+    profiler = None
+    if slow_request_ms:
+        profiler = SamplingProfiler(profile_interval_ms / 1000)
+        profiler.start()
+
+    @app.before_request
+    def start_timing():
+        g.request_started = time.perf_counter()
+        g.stage_timings = {}
+        g.sql_queries = 0
+        g.sql_seconds = 0.0
+        g.sql_statements = Counter()
+        if profiler:
+            profiler.begin()
+
+    @app.after_request
+    def finish_timing(response):
+        if 'request_started' not in g:
+            return response
+        total = time.perf_counter() - g.request_started
+        endpoint = request.endpoint or 'unknown'
+        stages = g.stage_timings
+        queries, query_seconds = request_stats()
+        response.headers['Server-Timing'] = server_timing(
+            stages, total, queries, query_seconds)
+        metrics.observe(endpoint, total, stages, queries, query_seconds)
+
+        if profiler:
+            samples = profiler.end()
+            if samples and total * 1000 >= slow_request_ms:
+                path = write_profile(samples, profile_dir, endpoint)
+                print(f"Slow request to {request.path} ({total * 1000:.0f}ms), "
+                      f"profile written to {path}")
+        return response
+
+    if profiler:
+        # Requests that failed before after_request still stop sampling
+        app.teardown_request(lambda exc: profiler.end())
+    return profiler
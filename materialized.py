@@ -0,0 +1,73 @@
+from sqlalchemy import insert
+from models import (MaterializedRecommendation, Story, UserInteraction,
+                    UserPreference, db)
+from catalog import SECTION_SIZE, story_card
+from database import read_session
+
+# Stories stored per user and category: enough to fill every page section
+TOP_N = 3 * SECTION_SIZE
+
+
+def load_stories(user_id, category):
+    """A user's precomputed stories for ``category``, best first.
+
+    Reads one range of the (user_id, category, rank) index. Returns None
+    when nothing is stored, either because the user was never precomputed
+    or because their feedback invalidated the stored ranking.
+    """
+    rows = read_session.query(
+        Story.id, Story.title, Story.author, Story.category,
+        Story.cover_image, MaterializedRecommendation.score
+    ).join(Story, Story.id == MaterializedRecommendation.story_id).filter(
+        MaterializedRecommendation.user_id == user_id,
+        MaterializedRecommendation.category == category
+    ).order_by(MaterializedRecommendation.rank).all()
+
+    if not rows:
+        return None
+    return [story_card(row, row.score) for row in rows]
+
+
+def replace_rankings(rankings, computed_at):
+    """Replace the stored rankings of every user in ``rankings``.
+
+    ``rankings`` maps each category to ``{user_id: [(story_id, score), ...]}``
+    as returned by ``StoryRecommender.rank_batch``. Rows are written with a
+    single executemany insert; the caller commits.
+    """
+    user_ids = sorted({uid for by_user in rankings.values() for uid in by_user})
+    if not user_ids:
+        return 0
+
+    MaterializedRecommendation.query.filter(
+        MaterializedRecommendation.user_id.in_(user_ids)
+    ).delete(synchronize_session=False)
+
+    rows = [
+        {'user_id': user_id, 'category': category, 'rank': rank,
+         'story_id': story_id, 'score': score, 'computed_at': computed_at}
+        for category, by_user in rankings.items()
+        for user_id, ranked in by_user.items()
+        for rank, (story_id, score) in enumerate(ranked)
+    ]
+    if rows:
+        db.session.execute(insert(MaterializedRecommendation), rows)
+    return len(rows)
+
+
+def invalidate_users(user_ids):
+    """Drop the users' stored rankings so requests fall back to online scoring"""
+    MaterializedRecommendation.query.filter(
+        MaterializedRecommendation.user_id.in_(user_ids)
+    ).delete(synchronize_session=False)
+
+
+def changed_since(user_ids, since):
+    """Users in ``user_ids`` with feedback or preference changes at or after ``since``"""
+    interactions = db.session.query(UserInteraction.user_id).filter(
+        UserInteraction.user_id.in_(user_ids),
+        UserInteraction.created_at >= since)
+    preferences = db.session.query(UserPreference.user_id).filter(
+        UserPreference.user_id.in_(user_ids),
+        UserPreference.last_updated >= since)
+    return {user_id for (user_id,) in interactions.union(preferences)}
@@ -0,0 +1,87 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from models import AppliedMigration, User, UserPreference
+from ai_model import preference_weight
+
+# Columns added to existing tables after their first release.
+# db.create_all() only creates missing tables, so older databases need
+# these applied explicitly.
+ADDED_COLUMNS = [
+    ('stories', 'updated_at', 'DATETIME'),
+    ('users', 'interaction_version', 'INTEGER NOT NULL DEFAULT 0'),
+    ('users', 'interactions_updated_at', 'DATETIME'),
+]
+
+
+def upgrade():
+    """Bring an existing database schema up to date with models.py"""
+    inspector = inspect(db.engine)
+    with db.engine.begin() as connection:
+        for table, column, column_type in ADDED_COLUMNS:
+            if not inspector.has_table(table):
+                continue
+            existing = {c['name'] for c in inspector.get_columns(table)}
+            if column not in existing:
+                connection.execute(
+                    text(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}'))
+
+    create_indexes()
+    run_once('backfill_user_preferences', backfill_user_preferences)
+
+
+def create_indexes():
+    """Create indexes declared in models.py that an existing database lacks"""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+
+def run_once(name, migrate):
+    """Run a data migration unless the database records it as applied.
+
+    The record is committed together with the migration's changes, so a
+    failed migration runs again on the next start, and when several
+    processes start at once only one of them commits it. Returns True
+    when the migration ran here.
+    """
+    AppliedMigration.__table__.create(db.engine, checkfirst=True)
+    if db.session.get(AppliedMigration, name):
+        return False
+
+    migrate()
+    db.session.add(AppliedMigration(name=name))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Applied by another process in the meantime
+        db.session.rollback()
+        return False
+    return True
+
+
+def backfill_user_preferences():
+    """Copy label preferences from users.preferences into user_preferences.
+
+    Category weights used to live in the users.preferences JSON column as
+    'high'/'medium'/'low' labels. Users that have no rows in
+    user_preferences get one per labelled category. The caller commits.
+    """
+    migrated = {user_id for (user_id,) in
+                db.session.query(UserPreference.user_id).distinct()}
+    for user in User.query.filter(User.preferences.isnot(None)).all():
+        if user.id in migrated or not isinstance(user.preferences, dict):
+            continue
+        for category, level in user.preferences.items():
+            weight = preference_weight(level)
+            if weight is not None:
+                db.session.add(UserPreference(
+                    user_id=user.id, category=category, weight=weight))
+
+
+if __name__ == '__main__':
+    import database
+
+    with database.create_app().app_context():
+        upgrade()
+        print('Database schema is up to date')
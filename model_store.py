@@ -0,0 +1,141 @@
+import json
+import os
+import shutil
+import uuid
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer
+from datetime import datetime
+from catalog import StoryColumns
+
+# Bump whenever the on-disk layout changes; artifacts written with another
+# format version are ignored and the model is rebuilt from the database.
+ARTIFACT_FORMAT_VERSION = 2
+
+# File in the artifact directory naming the most recently published build
+CURRENT_FILE = 'CURRENT'
+
+# Number of published builds kept on disk. Older builds may still be
+# memory-mapped by running workers, which is safe on POSIX since unlinked
+# files stay readable until unmapped.
+KEEP_BUILDS = 2
+
+SPARSE_MATRICES = ('term_counts', 'story_vectors', 'similarity_index')
+
+
+def save_snapshot(snapshot, directory):
+    """Write a model snapshot to ``directory`` as a new published build.
+
+    Arrays are stored as individual .npy files so that loaders can memory-map
+    them. The build is written to its own subdirectory and published by
+    atomically replacing the CURRENT pointer, so a concurrent loader never
+    sees a partially written build.
+    """
+    os.makedirs(directory, exist_ok=True)
+    build = f"v{snapshot.version}-{uuid.uuid4().hex[:8]}"
+    build_path = os.path.join(directory, build)
+    os.makedirs(build_path)
+
+    columns = snapshot.columns
+    arrays = {
+        'story_ids': columns.ids,
+        'category_codes': columns.category_codes,
+        'author_codes': columns.author_codes,
+        'created_at': columns.created_at.view(np.int64),
+        'document_frequency': snapshot.document_frequency,
+        'idf': snapshot.idf,
+    }
+    for name in SPARSE_MATRICES:
+        matrix = sparse.csr_matrix(getattr(snapshot, name))
+        arrays[f'{name}.data'] = matrix.data
+        arrays[f'{name}.indices'] = matrix.indices
+        arrays[f'{name}.indptr'] = matrix.indptr
+    for name, array in arrays.items():
+        np.save(os.path.join(build_path, f'{name}.npy'), array)
+
+    vocabulary = snapshot.vectorizer.vocabulary_
+    manifest = {
+        'format_version': ARTIFACT_FORMAT_VERSION,
+        'model_version': snapshot.version,
+        'last_update': snapshot.last_update.isoformat(),
+        'categories': columns.categories,
+        'authors': columns.authors,
+        'vocabulary': sorted(vocabulary, key=vocabulary.get),
+        'shapes': {name: list(getattr(snapshot, name).shape)
+                   for name in SPARSE_MATRICES},
+        'drift_tokens': snapshot.drift_tokens,
+        'total_tokens': snapshot.total_tokens,
+    }
+    with open(os.path.join(build_path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f)
+
+    _replace_file(os.path.join(directory, CURRENT_FILE), build)
+    _prune_builds(directory, build)
+    return build_path
+
+
+def load_snapshot(directory, make_snapshot):
+    """Load the current build from ``directory`` with memory-mapped arrays.
+
+    ``make_snapshot`` receives the loaded fields and returns the snapshot;
+    the recommender passes its own factory so the derived indexes are built
+    the same way as for freshly fitted models. Returns None when there is
+    no compatible build.
+    """
+    try:
+        with open(os.path.join(directory, CURRENT_FILE)) as f:
+            build_path = os.path.join(directory, f.read().strip())
+        with open(os.path.join(build_path, 'manifest.json')) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if manifest.get('format_version') != ARTIFACT_FORMAT_VERSION:
+        return None
+
+    def load(name):
+        return np.load(os.path.join(build_path, f'{name}.npy'), mmap_mode='r')
+
+    matrices = {
+        name: sparse.csr_matrix(
+            (load(f'{name}.data'), load(f'{name}.indices'),
+             load(f'{name}.indptr')),
+            shape=tuple(manifest['shapes'][name]))
+        for name in SPARSE_MATRICES
+    }
+
+    columns = StoryColumns(
+        load('story_ids'), load('category_codes'), manifest['categories'],
+        load('author_codes'), manifest['authors'],
+        load('created_at').view('datetime64[us]'))
+    vectorizer = CountVectorizer(
+        stop_words='english', vocabulary=manifest['vocabulary']).fit([])
+
+    return make_snapshot(
+        version=manifest['model_version'],
+        columns=columns,
+        vectorizer=vectorizer,
+        document_frequency=load('document_frequency'),
+        idf=load('idf'),
+        drift_tokens=manifest['drift_tokens'],
+        total_tokens=manifest['total_tokens'],
+        last_update=datetime.fromisoformat(manifest['last_update']),
+        **matrices)
+
+
+def _replace_file(path, content):
+    """Atomically replace the contents of a small text file"""
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as f:
+        f.write(content)
+    os.replace(temp_path, path)
+
+
+def _prune_builds(directory, current):
+    """Remove all but the newest KEEP_BUILDS builds"""
+    builds = [entry for entry in os.scandir(directory)
+              if entry.is_dir() and entry.name.startswith('v')]
+    builds.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in builds[KEEP_BUILDS:]:
+        if entry.name != current:
+            shutil.rmtree(entry.path, ignore_errors=True)
@@ -11,6 +11,11 @@ class User(db.Model):
     # Store user preferences as JSON
     preferences = db.Column(db.JSON, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Bumped whenever the user's feedback, preferences or stored
+    # recommendations change; part of the HTTP cache validators
+    interaction_version = db.Column(
+        db.Integer, nullable=False, default=0, server_default='0')
+    interactions_updated_at = db.Column(db.DateTime, nullable=True)
 
     # Relationships
     interactions = db.relationship(
@@ -24,12 +29,16 @@ class Story(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
-    author = db.Column(db.String(100), nullable=False)
-    category = db.Column(db.String(50), nullable=False)
+    author = db.Column(db.String(100), nullable=False, index=True)
+    category = db.Column(db.String(50), nullable=False, index=True)
     description = db.Column(db.Text, nullable=True)
     cover_image = db.Column(db.String(500), nullable=True)
     content = db.Column(db.Text, nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Indexed for the recommender's incremental refresh, which looks for
+    # stories created or updated since its last build
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow,
+                           onupdate=datetime.utcnow, index=True)
 
     # Relationships
     interactions = db.relationship(
@@ -48,10 +57,19 @@ class UserInteraction(db.Model):
     interaction_type = db.Column(db.String(20), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
-    # Ensure each user can only have one interaction per story
     __table_args__ = (
+        # Ensure each user can only have one interaction per story
         db.UniqueConstraint('user_id', 'story_id',
                             name='unique_user_story_interaction'),
+        # Covers the recommender's per-user interaction reads, so they
+        # never touch the table itself
+        db.Index('ix_user_interactions_user_positive',
+                 'user_id', 'is_positive', 'story_id', 'created_at'),
+        # Users with feedback since a given time
+        db.Index('ix_user_interactions_user_created',
+                 'user_id', 'created_at'),
+        # Per-story feedback totals for the story catalog
+        db.Index('ix_user_interactions_story', 'story_id', 'is_positive'),
     )
 
 
@@ -64,6 +82,14 @@ class UserPreference(db.Model):
     weight = db.Column(db.Float, default=1.0)
     last_updated = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        # Covers loading the category weights of a batch of users
+        db.Index('ix_user_preferences_user_category',
+                 'user_id', 'category', 'weight'),
+        db.Index('ix_user_preferences_user_updated',
+                 'user_id', 'last_updated'),
+    )
+
 
 class Feedback(db.Model):
     __tablename__ = 'feedback'
@@ -74,3 +100,31 @@ class Feedback(db.Model):
         'stories.id'), nullable=False)
     is_positive = db.Column(db.Boolean, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class MaterializedRecommendation(db.Model):
+    __tablename__ = 'materialized_recommendations'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    category = db.Column(db.String(50), nullable=False)
+    # 0 for the best match
+    rank = db.Column(db.Integer, nullable=False)
+    story_id = db.Column(db.Integer, db.ForeignKey(
+        'stories.id'), nullable=False)
+    score = db.Column(db.Float, nullable=False)
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Serves a user's ranked list for one category with a single index range scan
+    __table_args__ = (
+        db.Index('ix_materialized_user_category_rank',
+                 'user_id', 'category', 'rank'),
+    )
+
+
+class AppliedMigration(db.Model):
+    __tablename__ = 'applied_migrations'
+
+    # Name of a one-time data migration in migrations.py
+    name = db.Column(db.String(100), primary_key=True)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -0,0 +1,173 @@
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from models import db, User
+import database
+import materialized
+import migrations
+from ai_model import StoryRecommender, touch_users
+from config import Config
+
+# Progress of an interrupted run, so it can resume at the next chunk
+CHECKPOINT_FILE = 'precompute_checkpoint.json'
+
+# The app and recommender score_chunk uses in this process
+_app = None
+_recommender = None
+
+
+def create_recommender():
+    return StoryRecommender(
+        vocabulary_drift_threshold=Config.VOCABULARY_DRIFT_THRESHOLD,
+        artifact_dir=Config.MODEL_ARTIFACT_DIR)
+
+
+def init_worker():
+    """Set up a scoring process.
+
+    The recommender is created outside an app context, so it only
+    memory-maps the model artifacts the parent process published; it
+    does not refit or republish the model.
+    """
+    global _app, _recommender
+    _app = database.create_app()
+    _recommender = create_recommender()
+
+
+def score_chunk(user_ids, categories, top_n):
+    """Rank one chunk of users for every category"""
+    with _app.app_context():
+        return {category: _recommender.rank_batch(user_ids, category, top_n)
+                for category in categories}
+
+
+def load_checkpoint(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_checkpoint(path, checkpoint):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(temp_path, path)
+
+
+def precompute(chunk_size, workers, top_n, checkpoint_path, restart=False):
+    """Materialize the top ``top_n`` stories per user and category.
+
+    Users are walked in id order, one chunk at a time. Each chunk is
+    written and committed on its own and recorded in the checkpoint file,
+    so an interrupted run picks up after the last committed chunk.
+    """
+    global _app, _recommender
+    _app = database.create_app()
+    with _app.app_context():
+        db.create_all()
+        migrations.upgrade()
+        # Brings the model up to date and publishes it as artifacts, which
+        # the scoring processes then load
+        _recommender = create_recommender()
+
+        checkpoint = None if restart else load_checkpoint(checkpoint_path)
+        if checkpoint:
+            print(f"Resuming after user {checkpoint['last_user_id']}")
+        else:
+            checkpoint = {'last_user_id': 0, 'users': 0, 'rows': 0}
+
+        user_ids = [uid for (uid,) in db.session.query(User.id).filter(
+            User.id > checkpoint['last_user_id']).order_by(User.id)]
+        chunks = [user_ids[start:start + chunk_size]
+                  for start in range(0, len(user_ids), chunk_size)]
+        categories = ['All'] + _recommender.categories()
+        print(f"Scoring {len(user_ids)} users in {len(chunks)} chunks "
+              f"across {len(categories)} categories")
+
+        pool = None
+        if workers > 1:
+            # Spawned workers do not inherit the parent's database
+            # connections
+            pool = ProcessPoolExecutor(
+                workers, mp_context=multiprocessing.get_context('spawn'),
+                initializer=init_worker)
+
+        started = time.perf_counter()
+        pending = deque()
+        next_chunk = 0
+        users_done = 0
+        try:
+            while pending or next_chunk < len(chunks):
+                # Keep every worker busy while results are written in order
+                while next_chunk < len(chunks) and len(pending) < max(workers, 1) * 2:
+                    chunk = chunks[next_chunk]
+                    submitted_at = datetime.utcnow()
+                    if pool:
+                        result = pool.submit(score_chunk, chunk, categories, top_n)
+                    else:
+                        result = score_chunk(chunk, categories, top_n)
+                    pending.append((chunk, submitted_at, time.perf_counter(), result))
+                    next_chunk += 1
+
+                chunk, submitted_at, chunk_started, result = pending.popleft()
+                rankings = result.result() if pool else result
+
+                # Feedback that arrived while the chunk was being scored is
+                # not reflected in its rankings; leave those users online
+                stale = materialized.changed_since(chunk, submitted_at)
+                if stale:
+                    rankings = {category: {uid: ranked for uid, ranked in by_user.items()
+                                           if uid not in stale}
+                                for category, by_user in rankings.items()}
+
+                rows = materialized.replace_rankings(rankings, submitted_at)
+                touch_users(sorted({uid for by_user in rankings.values()
+                                    for uid in by_user}))
+                db.session.commit()
+
+                checkpoint['last_user_id'] = chunk[-1]
+                checkpoint['users'] += len(chunk)
+                checkpoint['rows'] += rows
+                save_checkpoint(checkpoint_path, checkpoint)
+
+                users_done += len(chunk)
+                elapsed = time.perf_counter() - chunk_started
+                print(f"Chunk ending at user {chunk[-1]}: {len(chunk)} users, "
+                      f"{rows} rows in {elapsed:.2f}s "
+                      f"({users_done / (time.perf_counter() - started):.0f} users/s overall)")
+        finally:
+            if pool:
+                pool.shutdown(cancel_futures=True)
+
+        elapsed = time.perf_counter() - started
+        print(f"Materialized {checkpoint['users']} users ({checkpoint['rows']} rows); "
+              f"this run scored {users_done} users in {elapsed:.2f}s "
+              f"({users_done / elapsed if elapsed else 0:.0f} users/s)")
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Precompute recommendations for every user')
+    parser.add_argument('--chunk-size', type=int, default=500,
+                        help='users scored and committed together')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='scoring processes; 1 scores in this process')
+    parser.add_argument('--top-n', type=int, default=materialized.TOP_N,
+                        help='stories stored per user and category')
+    parser.add_argument('--checkpoint', default=CHECKPOINT_FILE,
+                        help='file recording progress for restarts')
+    parser.add_argument('--restart', action='store_true',
+                        help='ignore an existing checkpoint and start over')
+    args = parser.parse_args()
+
+    precompute(args.chunk_size, args.workers, args.top_n,
+               args.checkpoint, args.restart)
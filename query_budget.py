@@ -0,0 +1,122 @@
+import json
+from contextlib import contextmanager
+from flask import current_app, g, request
+from instrumentation import count_queries, request_stats
+
+# Statements listed when a budget is exceeded, most repeated first
+REPORTED_STATEMENTS = 3
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A request or block ran more SQL than its budget allows"""
+
+
+def parse_budgets(value):
+    """Parse ``endpoint=limit`` pairs separated by commas into a dict"""
+    budgets = {}
+    for pair in (value or '').split(','):
+        if pair.strip():
+            endpoint, limit = pair.split('=', 1)
+            limit = limit.strip()
+            budgets[endpoint.strip()] = int(limit) if limit.isdigit() else float(limit)
+    return budgets
+
+
+def repeated_statements(statements):
+    """The most repeated statements, which is where N+1 patterns show up"""
+    return [{'count': count, 'statement': ' '.join(statement.split())[:200]}
+            for statement, count in statements.most_common(REPORTED_STATEMENTS)]
+
+
+def over_budget(queries, seconds, query_budget=None, time_budget_ms=None):
+    """Descriptions of the budgets a statement count and SQL time exceed"""
+    exceeded = []
+    if query_budget is not None and queries > query_budget:
+        exceeded.append(f'{queries} queries, budget {query_budget:g}')
+    if time_budget_ms is not None and seconds * 1000 > time_budget_ms:
+        exceeded.append(f'{seconds * 1000:.1f}ms of SQL, budget {time_budget_ms:g}ms')
+    return exceeded
+
+
+def init_app(app, query_budgets, time_budgets_ms=None, strict=False):
+    """Check every request of ``app`` against per-endpoint SQL budgets.
+
+    ``query_budgets`` and ``time_budgets_ms`` map endpoint names to the
+    most statements and milliseconds of SQL a request may use. A request
+    over budget logs a warning with the endpoint, the counts and a JSON
+    report of the most repeated statements. With ``strict``, or while the
+    app is in testing mode, it raises QueryBudgetExceeded instead, so a
+    test client request fails. Endpoints without a budget are not checked.
+    Needs instrumentation.init_app, which counts the statements.
+    """
+    time_budgets_ms = time_budgets_ms or {}
+
+    @app.after_request
+    def check_query_budget(response):
+        endpoint = request.endpoint
+        if endpoint not in query_budgets and endpoint not in time_budgets_ms:
+            return response
+
+        queries, seconds = request_stats()
+        exceeded = over_budget(queries, seconds, query_budgets.get(endpoint),
+                               time_budgets_ms.get(endpoint))
+        if not exceeded:
+            return response
+
+        report = {
+            'event': 'sql_budget_exceeded',
+            'endpoint': endpoint,
+            'method': request.method,
+            'path': request.path,
+            'queries': queries,
+            'query_budget': query_budgets.get(endpoint),
+            'sql_ms': round(seconds * 1000, 3),
+            'time_budget_ms': time_budgets_ms.get(endpoint),
+            'statements': repeated_statements(g.get('sql_statements')),
+        }
+        if strict or current_app.testing:
+            raise QueryBudgetExceeded(json.dumps(report))
+        current_app.logger.warning(
+            'SQL budget exceeded by %s %s on %s: %s. %s', request.method,
+            request.path, endpoint, '; '.join(exceeded), json.dumps(report))
+        return response
+
+
+@contextmanager
+def assert_max_queries(limit, max_ms=None):
+    """Fail when the block runs more than ``limit`` SQL statements.
+
+    For test suites, for example::
+
+        with assert_max_queries(8):
+            client.get('/api/recommendations?user_id=1')
+    """
+    with count_queries() as count:
+        yield count
+    exceeded = over_budget(count.queries, count.seconds, limit, max_ms)
+    if exceeded:
+        raise QueryBudgetExceeded(json.dumps({
+            'event': 'sql_budget_exceeded',
+            'exceeded': exceeded,
+            'statements': repeated_statements(count.statements),
+        }))
+
+
+def assert_constant_queries(*calls):
+    """Fail unless every call runs the same number of SQL statements.
+
+    Each call is a function with no arguments, for example the same
+    request made against a small and a large catalog.
+    """
+    counts = []
+    for call in calls:
+        with count_queries() as count:
+            call()
+        counts.append(count)
+    if len({count.queries for count in counts}) > 1:
+        raise QueryBudgetExceeded(json.dumps({
+            'event': 'sql_count_varies',
+            'queries': [count.queries for count in counts],
+            'statements': [repeated_statements(count.statements) for count in counts],
+        }))
+    return counts[0].queries if counts else 0
@@ -2,6 +2,7 @@ from flask import jsonify, request
 from app import app, db
 from models import Story, User, UserPreference, Feedback
 from utils import calculate_match_score
+from conditional import add_validators, make_etag, not_modified
 import random
 
 # Sample data for demonstration
@@ -62,8 +63,14 @@ def submit_feedback():
     })
 
 
+CATEGORIES = ['All', 'Fiction', 'Self-Help',
+              'Mystery', 'Romance', 'History', 'Business']
+CATEGORIES_ETAG = make_etag('categories', *CATEGORIES)
+
+
 @app.route('/api/categories')
 def get_categories():
-    categories = ['All', 'Fiction', 'Self-Help',
-                  'Mystery', 'Romance', 'History', 'Business']
-    return jsonify(categories)
+    cached = not_modified(CATEGORIES_ETAG)
+    if cached:
+        return cached
+    return add_validators(jsonify(CATEGORIES), CATEGORIES_ETAG)
@@ -1,7 +1,11 @@
 import random
 from datetime import datetime, timedelta
-from models import db, User, Story, UserInteraction
-from app import app
+from models import User, Story, UserInteraction, UserPreference
+from bulk_import import clear_tables, import_rows
+from ai_model import PREFERENCE_WEIGHTS
+from extensions import db
+import database
+import migrations
 
 # Sample data
 categories = ['Fiction', 'Self-Help',
@@ -26,17 +30,18 @@ user_names = [
 
 
 def generate_sample_data():
+    # A bare app: importing app.py would start its background threads
+    app = database.create_app()
     with app.app_context():
+        db.create_all()
+        migrations.upgrade()
+
         # Clear existing data
-        UserInteraction.query.delete()
-        Story.query.delete()
-        User.query.delete()
-        db.session.commit()
+        clear_tables()
 
-        # Create users
+        # Create users with random low/medium/high preferences
         users = []
-        for name in user_names:
-            # Generate random preferences using low/medium/high
+        for user_id, name in enumerate(user_names, 1):
             preferences = {}
             for category in categories:
                 rand = random.random()
@@ -47,30 +52,36 @@ def generate_sample_data():
                 else:
                     preferences[category] = 'high'
 
-            user = User(
-                username=name,
-                email=f"{name.lower()}@example.com",
-                preferences=preferences
-            )
-            users.append(user)
-            db.session.add(user)
-        db.session.commit()
+            users.append({
+                'id': user_id,
+                'username': name,
+                'email': f"{name.lower()}@example.com",
+                'preferences': preferences
+            })
+        import_rows(User.__table__, users)
+
+        # Category weights used by the recommender
+        import_rows(UserPreference.__table__, [
+            {'user_id': user['id'], 'category': category,
+             'weight': PREFERENCE_WEIGHTS[level]}
+            for user in users for category, level in user['preferences'].items()
+        ])
 
         # Create stories
         stories = []
-        for title in story_titles:
-            story = Story(
-                title=title,
-                author=random.choice(authors),
-                category=random.choice(categories),
-                description=f"This is a sample description for {title}. It's a {random.choice(categories)} story by {random.choice(authors)}.",
-                created_at=datetime.utcnow() - timedelta(days=random.randint(0, 365))
-            )
-            stories.append(story)
-            db.session.add(story)
-        db.session.commit()
+        for story_id, title in enumerate(story_titles, 1):
+            stories.append({
+                'id': story_id,
+                'title': title,
+                'author': random.choice(authors),
+                'category': random.choice(categories),
+                'description': f"This is a sample description for {title}. It's a {random.choice(categories)} story by {random.choice(authors)}.",
+                'created_at': datetime.utcnow() - timedelta(days=random.randint(0, 365))
+            })
+        import_rows(Story.__table__, stories)
 
         # Create user interactions
+        interactions = []
         for user in users:
             # Each user interacts with 5-15 random stories
             num_interactions = random.randint(5, 15)
@@ -79,18 +90,17 @@ def generate_sample_data():
             for story in interacted_stories:
                 # 70% chance of positive interaction
                 is_positive = random.random() < 0.7
-                interaction = UserInteraction(
-                    user_id=user.id,
-                    story_id=story.id,
-                    is_positive=is_positive,
-                    interaction_type='feedback',
-                    created_at=datetime.utcnow() - timedelta(days=random.randint(0, 30))
-                )
-                db.session.add(interaction)
+                interactions.append({
+                    'user_id': user['id'],
+                    'story_id': story['id'],
+                    'is_positive': is_positive,
+                    'interaction_type': 'feedback',
+                    'created_at': datetime.utcnow() - timedelta(days=random.randint(0, 30))
+                })
+        import_rows(UserInteraction.__table__, interactions)
 
-        db.session.commit()
         print(
-            f"Generated {len(users)} users, {len(stories)} stories, and {UserInteraction.query.count()} interactions")
+            f"Generated {len(users)} users, {len(stories)} stories, and {len(interactions)} interactions")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,249 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+from scipy import sparse
+from ai_model import (SCORE_BLOCK_ELEMENTS, StoryRecommender, score_rows,
+                      take_users)
+from instrumentation import record, stage
+
+# Fewest candidate stories given to one process when a catalog is split
+# across processes; below this the transfer costs more than it saves
+MIN_PART_ROWS = 50_000
+
+# Shared model arrays attached by a scoring process, keyed by model version
+_attached = {}
+
+
+class SharedModel:
+    """The arrays scoring needs from one snapshot, in shared memory.
+
+    Story ids, category and author codes, the rows of each category and
+    the similarity index's CSR arrays are copied once into named shared
+    memory blocks. Scoring processes map the blocks by name, so tasks only
+    carry a small descriptor instead of the model itself.
+    """
+
+    def __init__(self, snapshot):
+        columns = snapshot.columns
+        order = np.argsort(columns.category_codes, kind='stable')
+        bounds = np.searchsorted(columns.category_codes[order],
+                                 np.arange(len(columns.categories) + 1))
+        similarity = snapshot.similarity_index.tocsr()
+
+        self.version = snapshot.version
+        self.categories = list(columns.categories)
+        self._blocks = []
+        arrays = {}
+        try:
+            for name, array in [
+                    ('ids', columns.ids),
+                    ('category_codes', columns.category_codes),
+                    ('author_codes', columns.author_codes),
+                    ('category_rows', order),
+                    ('category_bounds', bounds),
+                    ('similarity_data', similarity.data),
+                    ('similarity_indices', similarity.indices),
+                    ('similarity_indptr', similarity.indptr)]:
+                array = np.ascontiguousarray(array)
+                # Zero-size blocks are not allowed
+                block = SharedMemory(create=True, size=max(array.nbytes, 1))
+                self._blocks.append(block)
+                np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+                arrays[name] = (block.name, array.dtype.str, array.shape)
+        except Exception:
+            self.unlink()
+            raise
+
+        self.descriptor = {
+            'version': self.version,
+            'arrays': arrays,
+            'similarity_shape': similarity.shape,
+        }
+
+    def unlink(self):
+        """Release the blocks; processes that already mapped them keep their copy"""
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+
+def _attach(descriptor):
+    """Map a shared model in a scoring process, reusing an earlier mapping"""
+    version = descriptor['version']
+    model = _attached.get(version)
+    if model is not None:
+        return model
+
+    # Only the latest model is used once a newer one arrives. Its arrays
+    # are views of the blocks and must be released before they close.
+    stale = list(_attached.values())
+    _attached.clear()
+    for blocks, arrays in stale:
+        arrays.clear()
+        for block in blocks:
+            block.close()
+
+    blocks = []
+    arrays = {}
+    for name, (block_name, dtype, shape) in descriptor['arrays'].items():
+        # Pool processes report to the serving process's resource tracker,
+        # so attaching here does not hand ownership of the block over
+        block = SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+
+    arrays['similarity_index'] = sparse.csr_matrix(
+        (arrays.pop('similarity_data'), arrays.pop('similarity_indices'),
+         arrays.pop('similarity_indptr')),
+        shape=descriptor['similarity_shape'], copy=False)
+    model = _attached[version] = (blocks, arrays)
+    return model
+
+
+def _score_part(descriptor, signals, category_code, start, stop, limit):
+    """Score users against candidate stories ``start`` to ``stop - 1``.
+
+    Runs in a scoring process. Returns the story ids and scores of each
+    user's best ``limit`` stories in the part, best first, as two
+    users x k arrays, and the seconds spent.
+    """
+    started = time.perf_counter()
+    _, model = _attach(descriptor)
+    if category_code is None:
+        rows = np.arange(len(model['ids']))
+    else:
+        bounds = model['category_bounds']
+        rows = model['category_rows'][bounds[category_code]:bounds[category_code + 1]]
+    rows = rows[start:stop]
+
+    n_users = signals.preferences.shape[0]
+    k = min(limit, len(rows))
+    story_ids = np.zeros((n_users, k), dtype=np.int64)
+    scores = np.zeros((n_users, k))
+    block_size = max(1, SCORE_BLOCK_ELEMENTS // max(len(rows), 1))
+    for first in range(0, n_users, block_size):
+        last = min(first + block_size, n_users)
+        block_scores = score_rows(
+            take_users(signals, first, last), rows, model['category_codes'],
+            model['author_codes'], model['similarity_index'])
+        for position, user_scores in enumerate(block_scores, first):
+            selected = StoryRecommender._ranked_slice(user_scores, 0, k)
+            story_ids[position] = model['ids'][rows[selected]]
+            scores[position] = user_scores[selected]
+    return story_ids, scores, time.perf_counter() - started
+
+
+class ScoringPool:
+    """Process pool for CPU-bound scoring.
+
+    Scoring holds the GIL for most of its run, so in a threaded or async
+    server it stalls every other request in the process. The pool moves
+    the array work to separate processes. Users' preferences and
+    interactions are loaded here and passed in as small matrices; the
+    model itself is placed in shared memory once per version (see
+    SharedModel), so scoring processes neither refit nor load it and need
+    no database connection. Processes are started on first use.
+
+    Batches with at least one user per process are split across processes
+    by user. Smaller batches against a large catalog are split by
+    candidate stories instead, and each process's best stories are merged.
+    """
+
+    def __init__(self, recommender, size):
+        self.recommender = recommender
+        self.size = size
+        self._executor = None
+        self._lock = threading.Lock()
+        # The model being shared and the one before it, which tasks
+        # submitted just before a refresh may still be attaching to
+        self._shared = []
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # Spawned rather than forked: the serving process runs
+                # background threads and holds open database connections
+                self._executor = ProcessPoolExecutor(
+                    self.size, mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def _share(self, snapshot):
+        """The shared copy of ``snapshot``, creating it when the model has changed"""
+        with self._lock:
+            if self._shared and self._shared[-1].version == snapshot.version:
+                return self._shared[-1]
+            shared = SharedModel(snapshot)
+            self._shared.append(shared)
+            while len(self._shared) > 2:
+                self._shared.pop(0).unlink()
+            return shared
+
+    def _parts(self, n_users, n_rows):
+        """Split a batch into (user range, candidate range) parts"""
+        if n_users >= self.size:
+            bounds = np.linspace(0, n_users, self.size + 1).astype(int).tolist()
+            return [((bounds[i], bounds[i + 1]), (0, n_rows))
+                    for i in range(self.size) if bounds[i] < bounds[i + 1]]
+        parts = max(1, min(self.size, n_rows // MIN_PART_ROWS))
+        bounds = np.linspace(0, n_rows, parts + 1).astype(int).tolist()
+        return [((0, n_users), (bounds[i], bounds[i + 1])) for i in range(parts)]
+
+    def rank_batch(self, user_ids, category='All', limit=6):
+        """Same as StoryRecommender.rank_batch, scored in the pool's processes.
+
+        Stage timings are recorded for the current request: ``pool-score``
+        is the wait for the processes and ``pool-worker`` the longest time
+        one of them spent scoring.
+        """
+        snapshot = self.recommender._current_snapshot()
+        if snapshot is None:
+            return {}
+
+        with stage('db'):
+            user_ids = self.recommender.known_user_ids(user_ids)
+            rows = self.recommender._candidate_rows(snapshot, category)
+            if not user_ids or not len(rows):
+                return {user_id: [] for user_id in user_ids}
+            signals = self.recommender._user_signals(user_ids, snapshot)
+
+        with stage('pool-share'):
+            shared = self._share(snapshot)
+            category_code = None if category == 'All' else shared.categories.index(category)
+
+        with stage('pool-score'):
+            executor = self._get_executor()
+            futures = [
+                (users, executor.submit(
+                    _score_part, shared.descriptor, take_users(signals, *users),
+                    category_code, *candidates, limit))
+                for users, candidates in self._parts(len(user_ids), len(rows))]
+            results = [(users, future.result()) for users, future in futures]
+        record('pool-worker', max(elapsed for _, (_, _, elapsed) in results))
+
+        ranked = {}
+        with stage('sort'):
+            for position, user_id in enumerate(user_ids):
+                # Parts cover consecutive candidates, so concatenating them keeps
+                # catalog order and ties break exactly as in a single pass
+                parts = [(story_ids[position - first], scores[position - first])
+                         for (first, last), (story_ids, scores, _) in results
+                         if first <= position < last]
+                story_ids = np.concatenate([ids for ids, _ in parts])
+                scores = np.concatenate([part_scores for _, part_scores in parts])
+                selected = StoryRecommender._ranked_slice(scores, 0, limit)
+                ranked[user_id] = list(zip(story_ids[selected].tolist(),
+                                           scores[selected].tolist()))
+        return ranked
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+            for shared in self._shared:
+                shared.unlink()
+            self._shared = []
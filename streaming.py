@@ -0,0 +1,40 @@
+import json
+from flask import Response, request, stream_with_context
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def wants_ndjson():
+    """Whether the client asked for newline-delimited JSON.
+
+    Chosen with an ``Accept: application/x-ndjson`` header or a
+    ``format=ndjson`` query parameter.
+    """
+    if request.args.get('format') == 'ndjson':
+        return True
+    return request.accept_mimetypes.best_match(
+        ['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+def ndjson_response(items):
+    """Stream ``items`` as one JSON document per line.
+
+    Items are encoded as the generator yields them, so neither the full
+    list nor the full response body is ever held in memory.
+    """
+    def generate():
+        for item in items:
+            yield json.dumps(item) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+
+def json_array_response(items):
+    """Stream ``items`` as a single JSON array, encoding one item at a time"""
+    def generate():
+        yield '['
+        for position, item in enumerate(items):
+            yield (',' if position else '') + json.dumps(item)
+        yield ']\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
@@ -0,0 +1,96 @@
+"""Shared fixtures: the app on a temporary SQLite database with a small catalog"""
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+import pytest
+
+# Configured before app.py is imported, since Config reads the environment once
+_tmp_dir = tempfile.mkdtemp(prefix='storymorph-tests-')
+os.environ.update({
+    'DATABASE_URL': 'sqlite:///' + os.path.join(_tmp_dir, 'test.db'),
+    'MODEL_ARTIFACT_DIR': os.path.join(_tmp_dir, 'model_artifacts'),
+    'FEEDBACK_JOURNAL_PATH': os.path.join(_tmp_dir, 'feedback_journal.ndjson'),
+    'SCORING_POOL_SIZE': '0',
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Stories per category; Fiction is smaller than one page of sections
+CATEGORY_SIZES = {'Fiction': 3, 'Mystery': 8, 'Romance': 6, 'History': 5,
+                  'Business': 5, 'Self-Help': 3}
+AUTHORS = ['Jane Doe', 'John Smith', 'Emily Davis', 'Robert Johnson']
+
+
+@pytest.fixture(scope='session')
+def app_module():
+    import app as module
+    module.app.testing = True
+    # Fixtures rebuild the model and apply feedback themselves
+    for thread in (module.recommender.refresh_worker, module.feedback_consumer):
+        thread.stop()
+        thread.join()
+    return module
+
+
+@pytest.fixture
+def seeded(app_module):
+    """Reset the database to the small catalog and rebuild the model from it"""
+    from bulk_import import clear_tables, import_rows
+    from models import Story, User, UserInteraction, UserPreference
+
+    now = datetime.utcnow()
+    stories = []
+    for category, size in CATEGORY_SIZES.items():
+        for _ in range(size):
+            story_id = len(stories) + 1
+            stories.append({
+                'id': story_id,
+                'title': f'{category} story {story_id}',
+                'author': AUTHORS[story_id % len(AUTHORS)],
+                'category': category,
+                'description': f'A {category.lower()} story by '
+                               f'{AUTHORS[story_id % len(AUTHORS)]}',
+                'created_at': now - timedelta(days=story_id),
+            })
+    users = [{'id': user_id, 'username': f'user{user_id}',
+              'email': f'user{user_id}@example.com'} for user_id in (1, 2, 3, 4)]
+    preferences = [{'user_id': user['id'], 'category': category, 'weight': 0.5}
+                   for user in users for category in CATEGORY_SIZES]
+    interactions = [{'user_id': user['id'], 'story_id': story['id'],
+                     'is_positive': (user['id'] + story['id']) % 3 != 0,
+                     'interaction_type': 'feedback', 'created_at': now}
+                    for user in users for story in stories[user['id']::5]]
+
+    with app_module.app.app_context():
+        clear_tables()
+        import_rows(User.__table__, users, report=False)
+        import_rows(Story.__table__, stories, report=False)
+        import_rows(UserPreference.__table__, preferences, report=False)
+        import_rows(UserInteraction.__table__, interactions, report=False)
+        app_module.recommender.cache.clear()
+        app_module.recommender.update_model()
+        app_module.reload_catalog()
+    return app_module
+
+
+@pytest.fixture
+def client(seeded):
+    return seeded.app.test_client()
+
+
+@pytest.fixture
+def materialize(seeded):
+    """Store a user's current ranking for a category as a precompute run would"""
+    import materialized
+    from models import db
+
+    def store(user_id, category):
+        with seeded.app.app_context():
+            ranked = seeded.recommender.rank_batch(
+                [user_id], category, materialized.TOP_N)
+            materialized.replace_rankings({category: ranked}, datetime.utcnow())
+            db.session.commit()
+        return [story_id for story_id, _ in ranked[user_id]]
+
+    return store
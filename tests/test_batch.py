@@ -0,0 +1,20 @@
+def test_batch_recommendations(client):
+    response = client.post('/api/recommendations/batch',
+                           json={'user_ids': [1, 2], 'limit': 3})
+    assert response.status_code == 200
+    recommendations = response.get_json()['recommendations']
+    assert set(recommendations) == {'1', '2'}
+    assert all(len(stories) == 3 for stories in recommendations.values())
+
+
+def test_batch_rejects_non_object_body(client):
+    for body in ([1, 2], 'users', 3):
+        response = client.post('/api/recommendations/batch', json=body)
+        assert response.status_code == 400
+
+
+def test_batch_rejects_bool_limit(client):
+    for limit in (True, False):
+        response = client.post('/api/recommendations/batch',
+                               json={'user_ids': [1], 'limit': limit})
+        assert response.status_code == 400
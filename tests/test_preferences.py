@@ -0,0 +1,21 @@
+def test_update_preferences_saves_weights(client):
+    response = client.put('/api/users/1/preferences',
+                          json={'preferences': {'Fiction': 'high', 'Mystery': 0.4}})
+    assert response.status_code == 200
+
+    user = client.get('/api/users/1').get_json()
+    assert user['preference_weights']['Fiction'] == 1.0
+    assert user['preference_weights']['Mystery'] == 0.4
+
+
+def test_update_preferences_rejects_non_object(client):
+    for preferences in (['Fiction'], 'Fiction', 3):
+        response = client.put('/api/users/1/preferences',
+                              json={'preferences': preferences})
+        assert response.status_code == 400
+
+
+def test_update_preferences_rejects_invalid_weight(client):
+    response = client.put('/api/users/1/preferences',
+                          json={'preferences': {'Fiction': 'very high'}})
+    assert response.status_code == 400
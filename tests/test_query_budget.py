@@ -0,0 +1,74 @@
+import logging
+
+import pytest
+
+import database
+import instrumentation
+import query_budget
+from config import Config
+from instrumentation import RequestMetrics
+from models import User
+from query_budget import QueryBudgetExceeded, assert_max_queries
+
+BUDGETS = query_budget.parse_budgets(Config.SQL_QUERY_BUDGETS)
+
+
+def test_online_recommendations_budget(client):
+    with assert_max_queries(BUDGETS['get_recommendations']):
+        response = client.get('/api/recommendations?user_id=1')
+    assert response.status_code == 200
+
+
+def test_materialized_recommendations_budget(seeded, materialize):
+    materialize(1, 'Mystery')
+    client = seeded.app.test_client()
+    with assert_max_queries(BUDGETS['get_recommendations']):
+        response = client.get('/api/recommendations?user_id=1&category=Mystery')
+    assert response.status_code == 200
+
+
+def test_recommendations_page_budget(client):
+    with assert_max_queries(BUDGETS['get_recommendations_page']):
+        first = client.get('/api/recommendations/page?user_id=2&page_size=4')
+    cursor = first.get_json()['next_cursor']
+    with assert_max_queries(BUDGETS['get_recommendations_page']):
+        second = client.get(
+            f'/api/recommendations/page?user_id=2&page_size=4&cursor={cursor}')
+    assert first.status_code == second.status_code == 200
+
+
+def test_assert_max_queries_fails_over_budget(client):
+    with pytest.raises(QueryBudgetExceeded):
+        with assert_max_queries(0):
+            client.get('/api/recommendations?user_id=1')
+
+
+def budget_app(strict=False):
+    app = database.create_app()
+    instrumentation.init_app(app, RequestMetrics())
+    query_budget.init_app(app, {'count_users': 0}, strict=strict)
+
+    @app.route('/count')
+    def count_users():
+        return {'users': User.query.count()}
+
+    return app
+
+
+def test_over_budget_request_logs_warning(seeded, caplog):
+    client = budget_app().test_client()
+    with caplog.at_level(logging.WARNING):
+        response = client.get('/count')
+
+    assert response.status_code == 200
+    warnings = [record.getMessage() for record in caplog.records
+                if record.levelno == logging.WARNING]
+    assert len(warnings) == 1
+    assert 'count_users' in warnings[0]
+    assert '1 queries, budget 0' in warnings[0]
+
+
+def test_strict_budget_fails_request(seeded):
+    client = budget_app(strict=True).test_client()
+    with pytest.raises(QueryBudgetExceeded):
+        client.get('/count')
@@ -0,0 +1,56 @@
+import materialized
+from catalog import SECTION_SIZE
+
+
+def test_small_category_sections_are_filled(seeded, materialize):
+    client = seeded.app.test_client()
+    ranked = materialize(1, 'Fiction')
+    assert 0 < len(ranked) < SECTION_SIZE
+
+    sections = client.get(
+        '/api/recommendations?user_id=1&category=Fiction').get_json()
+
+    assert all(sections[name] for name in
+               ('highly_recommended', 'because_you_listened', 'new_discoveries'))
+    assert all(len(stories) <= SECTION_SIZE for stories in sections.values())
+    # The user's own ranking leads, topped up from the catalog
+    highly_recommended = [story['id'] for story in sections['highly_recommended']]
+    assert highly_recommended[:len(ranked)] == ranked
+    assert len(highly_recommended) == SECTION_SIZE
+    shown = [story['id'] for stories in sections.values() for story in stories]
+    assert len(shown) == len(set(shown))
+
+
+def test_large_category_sections_are_consecutive(seeded, materialize):
+    client = seeded.app.test_client()
+    ranked = materialize(2, 'All')
+
+    sections = client.get('/api/recommendations?user_id=2').get_json()
+
+    assert [story['id'] for story in sections['highly_recommended']
+            + sections['because_you_listened']
+            + sections['new_discoveries']] == ranked
+
+
+class BatchOnlyPool:
+    """Stands in for a ScoringPool and fails if a single user is sent to it"""
+
+    def rank_batch(self, user_ids, category='All', limit=6):
+        raise AssertionError('single-user request sent to the scoring pool')
+
+
+def test_online_requests_skip_the_scoring_pool(seeded, monkeypatch):
+    monkeypatch.setattr(seeded, 'scoring_pool', BatchOnlyPool())
+    client = seeded.app.test_client()
+
+    response = client.get('/api/recommendations?user_id=3')
+
+    assert response.status_code == 200
+    with seeded.app.app_context():
+        ranked = seeded.recommender.get_top_scores(3, 'All', materialized.TOP_N)
+    sections = response.get_json()
+    assert [story['id'] for story in sections['highly_recommended']
+            + sections['because_you_listened']
+            + sections['new_discoveries']] == [story_id for story_id, _ in ranked]
+    # Scored once, through the recommendation cache
+    assert len(seeded.recommender.cache) == 1
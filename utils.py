@@ -1,4 +1,5 @@
 import numpy as np
+from scipy import sparse
 from sklearn.metrics.pairwise import cosine_similarity
 
 
@@ -19,6 +20,38 @@ def calculate_match_score(user_preferences, story_features):
     return int(similarity * 100)
 
 
+def calculate_match_scores(weight_matrix, feature_matrix):
+    """
+    Calculate match scores between many users and many stories at once
+    ``weight_matrix`` has one row of preference weights per user and
+    ``feature_matrix`` one row per story over the same features, dense or
+    scipy sparse. Returns a users x stories array holding, for each pair,
+    the score calculate_match_score gives: the cosine similarity times
+    100, truncated to an int, and 0 when either row is all zeros.
+    """
+    users = _normalize_rows(weight_matrix)
+    stories = _normalize_rows(feature_matrix)
+    similarity = users @ stories.T
+    if sparse.issparse(similarity):
+        similarity = similarity.toarray()
+    return np.trunc(np.asarray(similarity) * 100).astype(np.int64)
+
+
+def _normalize_rows(matrix):
+    """Scale each row to unit length, leaving all-zero rows as they are"""
+    if sparse.issparse(matrix):
+        matrix = sparse.csr_matrix(matrix, dtype=np.float64, copy=True)
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        matrix.data /= np.repeat(norms, np.diff(matrix.indptr))
+        return matrix
+
+    matrix = np.array(matrix, dtype=np.float64, ndmin=2)
+    norms = np.sqrt(np.einsum('ij,ij->i', matrix, matrix))
+    norms[norms == 0] = 1
+    return matrix / norms[:, None]
+
+
 def update_user_preferences(user_id, story_id, is_positive):
     """
     Update user preferences based on feedback